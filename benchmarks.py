@@ -0,0 +1,305 @@
+#----------------------------------------------------------------------------
+# Name:        benchmarks.py
+# Purpose:     Per-Stage Benchmarks for Deck Rendering
+# Author:    Drew Fulton
+# Created:    October 2026
+#
+# Runs entirely from fixtures recorded with `deckbot.py --record DIR`, so no
+# network is involved:
+#
+#   python benchmarks.py fixtures/ --save-baseline   # record a baseline
+#   python benchmarks.py fixtures/                   # compare against it
+#
+# The baseline is benchmarks-baseline.json next to this file; --baseline PATH
+# compares against another file.  None is shipped, since timings depend on
+# the machine, so record one with --save-baseline before the first compare.
+#
+# Exits with status 1 if any stage, throughput or memory figure is worse than
+# the baseline by more than --tolerance.
+
+import os, sys, json, time, glob, argparse, statistics, tracemalloc, itertools
+
+from pptx.presentation import Presentation
+
+import models
+import presenters
+import standin
+
+default_baseline = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "benchmarks-baseline.json"
+)
+
+
+def load_company(fixtures, company_id):
+    ''' Build a fully loaded Company from recorded fixtures, without the API
+    '''
+    def read(path):
+        with open(standin.fixture_path(fixtures, path), "rb") as f:
+            return json.loads(f.read())
+
+    company = models.Company(company_id)
+    company.load_overview(read(f"/api/companies/{company_id}"))
+    for metric in company.load_metrics(read(f"/api/companies/{company_id}/metrics")):
+        try:
+            metric.load_details(read(f"/api/companies/{company_id}/metrics/{metric.id}"))
+        except OSError:
+            pass
+    logo = glob.glob(
+        os.path.join(fixtures, "logos", standin.url_digest(company.logoUrl or "") + "*")
+    )
+    if logo:
+        with open(logo[0], "rb") as f:
+            company.logo_image = f.read()
+    return company
+
+
+def fixture_company_ids(fixtures):
+    ''' Ids of every company with a recorded overview and Revenue details
+    '''
+    ids = []
+    for path in sorted(glob.glob(os.path.join(fixtures, "api", "companies", "*.json"))):
+        company_id = os.path.basename(path)[:-len(".json")]
+        if company_id != "index" and os.path.isdir(path[:-len(".json")]):
+            ids.append(company_id)
+    return ids
+
+
+class StageTimer(object):
+    ''' Times each rendering stage while active.  Slide builders,
+    create_textbox and add_chart are wrapped on the presenter; the template
+    copy and the final save are wrapped on their classes.  Times are
+    inclusive, so a slide builder's time contains its textboxes and charts.
+    '''
+    def __init__(self, presenter):
+        self.presenter = presenter
+        self.times = {}
+        self.patched = []
+
+    def __enter__(self):
+        for name in ("build_title_slide", "build_overview_slide", "build_revenue_slide", "create_textbox", "add_chart"):
+            self.wrap(self.presenter, name, name, instance=True)
+        self.wrap(Presentation, "save", "ppt.save")
+        self.wrap(presenters.DeckTemplate, "new_deck", "template copy")
+        return self
+
+    def __exit__(self, *exc):
+        for owner, name, original, instance in reversed(self.patched):
+            if instance:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, original)
+        self.patched = []
+
+    def wrap(self, owner, name, stage, instance=False):
+        original = getattr(owner, name)
+        times = self.times.setdefault(stage, [])
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                times.append(time.perf_counter() - start)
+
+        setattr(owner, name, timed)
+        self.patched.append((owner, name, original, instance))
+
+
+def bench_stages(presenter, companies, decks):
+    ''' Median milliseconds per deck spent in each stage
+    '''
+    per_deck = {}
+    for company in itertools.islice(itertools.cycle(companies), decks):
+        with StageTimer(presenter) as timer:
+            start = time.perf_counter()
+            presenter.render_deck(company)
+            timer.times["whole deck"] = [time.perf_counter() - start]
+        for stage, times in timer.times.items():
+            per_deck.setdefault(stage, []).append(sum(times))
+    return {stage: statistics.median(t) * 1000 for stage, t in per_deck.items()}
+
+
+def bench_charts(presenter, companies, decks):
+    ''' Median milliseconds per deck spent adding charts, first through
+    python-pptx's add_chart and xlsxwriter, then through add_quick_chart and
+    QuickWorkbookWriter
+    '''
+    modes = {}
+    for label, quick in (("xlsxwriter", False), ("quick", True)):
+        presenter.quick_charts = quick
+        try:
+            modes[label] = bench_stages(presenter, companies, decks)["add_chart"]
+        finally:
+            del presenter.quick_charts
+    return modes
+
+
+def bench_throughput(presenter, fixtures, company_ids, size):
+    ''' Decks per second rendering size companies in a row, loading each from
+    the fixtures as batch mode would
+    '''
+    start = time.perf_counter()
+    for company_id in itertools.islice(itertools.cycle(company_ids), size):
+        presenter.render_deck(load_company(fixtures, company_id))
+    return size / (time.perf_counter() - start)
+
+
+def bench_memory(presenter, fixtures, company_ids, size, rendered=10):
+    ''' Peak traced MB while holding size companies in memory and rendering
+    up to rendered of them
+    '''
+    tracemalloc.start()
+    try:
+        companies = [
+            load_company(fixtures, company_id)
+            for company_id in itertools.islice(itertools.cycle(company_ids), size)
+        ]
+        for company in companies[:rendered]:
+            presenter.render_deck(company)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / (1024 * 1024)
+
+
+long_description_sentences = (
+    "Apple Inc. designs, manufactures and markets smartphones, personal computers, tablets and wearables.",
+    "The company sells its products through apple.com, its retail stores and third-party resellers in the U.S. and abroad.",
+    "Dr. Jane Smith, Ph.D. in economics, joined the board in 2019.",
+    "However the U.S.A. remains its largest market by revenue.",
+    "Is growth sustainable? Analysts at J.P. Morgan Co. think so!",
+    "It was founded by Steve Jobs, Steve Wozniak and Ronald Wayne in Cupertino, Calif. in 1976.",
+)
+
+
+def long_description(paragraphs):
+    ''' A multi-paragraph description full of abbreviations, initials and
+    websites for timing the sentence splitter
+    '''
+    paragraph = " ".join(long_description_sentences * 4)
+    return "\n".join(f"{paragraph} Paragraph {n}." for n in range(paragraphs))
+
+
+def bench_sentences(paragraphs, repeats=50):
+    ''' Median milliseconds to split a long description, first uncached and
+    then answered from the cache as a repeat render would be
+    '''
+    text = long_description(paragraphs)
+    uncached, cached = [], []
+    for _ in range(repeats):
+        presenters.cached_sentences.cache_clear()
+        start = time.perf_counter()
+        presenters.split_into_sentences(text)
+        uncached.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        presenters.split_into_sentences(text)
+        cached.append(time.perf_counter() - start)
+    return {
+        f"{paragraphs} paragraphs": statistics.median(uncached) * 1000,
+        f"{paragraphs} paragraphs, cached": statistics.median(cached) * 1000,
+    }
+
+
+def run(fixtures, sizes, decks, paragraphs=20):
+    company_ids = fixture_company_ids(fixtures)
+    if not company_ids:
+        raise SystemExit(f"No recorded companies found in {fixtures}")
+    presenter = presenters.DeckbotPresenter()
+    companies = [load_company(fixtures, c) for c in company_ids]
+    # Warm the template and imports before timing anything.
+    presenter.render_deck(companies[0])
+
+    results = {
+        "stages": bench_stages(presenter, companies, decks),
+        "text": bench_sentences(paragraphs),
+        "charts": bench_charts(presenter, companies, decks),
+        "throughput": {},
+        "memory": {},
+    }
+    for size in sizes:
+        results["throughput"][str(size)] = bench_throughput(presenter, fixtures, company_ids, size)
+        results["memory"][str(size)] = bench_memory(presenter, fixtures, company_ids, size)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    ''' Lines describing every figure worse than the baseline by more than
+    tolerance (a fraction)
+    '''
+    regressions = []
+    for stage, ms in results["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if base and ms > base * (1 + tolerance):
+            regressions.append(f"{stage}: {ms:.2f} ms per deck, baseline {base:.2f} ms")
+    for text, ms in results.get("text", {}).items():
+        base = baseline.get("text", {}).get(text)
+        if base and ms > base * (1 + tolerance):
+            regressions.append(f"sentence splitting, {text}: {ms:.3f} ms, baseline {base:.3f} ms")
+    for mode, ms in results.get("charts", {}).items():
+        base = baseline.get("charts", {}).get(mode)
+        if base and ms > base * (1 + tolerance):
+            regressions.append(f"charts, {mode}: {ms:.2f} ms per deck, baseline {base:.2f} ms")
+    for size, rate in results["throughput"].items():
+        base = baseline.get("throughput", {}).get(size)
+        if base and rate < base / (1 + tolerance):
+            regressions.append(f"{size} companies: {rate:.1f} decks/s, baseline {base:.1f} decks/s")
+    for size, mb in results["memory"].items():
+        base = baseline.get("memory", {}).get(size)
+        if base and mb > base * (1 + tolerance):
+            regressions.append(f"{size} companies: peak {mb:.1f} MB, baseline {base:.1f} MB")
+    return regressions
+
+
+def report(results):
+    print("Stage (median ms per deck)")
+    for stage, ms in sorted(results["stages"].items(), key=lambda s: -s[1]):
+        print(f"  {stage:<22}{ms:>9.2f}")
+    print("Sentence splitting (median ms per description)")
+    for text, ms in results["text"].items():
+        print(f"  {text:<30}{ms:>9.3f}")
+    print("Charts (median ms per deck)")
+    for mode, ms in results["charts"].items():
+        print(f"  {mode:<22}{ms:>9.2f}")
+    charts = results["charts"]
+    if charts.get("quick"):
+        print(f"  {'speedup':<22}{charts['xlsxwriter'] / charts['quick']:>8.1f}x")
+    print("Throughput and peak traced memory")
+    for size, rate in results["throughput"].items():
+        print(f"  {size:>5} companies  {rate:>8.1f} decks/s  {results['memory'][size]:>8.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark deck rendering stages")
+    parser.add_argument("fixtures", help="Directory written by deckbot.py --record")
+    parser.add_argument("--sizes", default="1,10,1000",
+        help="Comma separated company counts for throughput runs (default: 1,10,1000)")
+    parser.add_argument("--decks", default=20, type=int,
+        help="Decks rendered to time each stage (default: 20)")
+    parser.add_argument("--paragraphs", default=20, type=int,
+        help="Paragraphs in the long description used to time sentence splitting (default: 20)")
+    parser.add_argument("--baseline", default=default_baseline,
+        help="Baseline file to compare against or save to (default: benchmarks-baseline.json)")
+    parser.add_argument("--save-baseline", action="store_true",
+        help="Store these results as the new baseline")
+    parser.add_argument("--tolerance", default=0.25, type=float,
+        help="Allowed slowdown before a figure counts as a regression (default: 0.25)")
+    args = parser.parse_args()
+
+    results = run(args.fixtures, [int(s) for s in args.sizes.split(",")], args.decks, args.paragraphs)
+    report(results)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; record one with --save-baseline")
+    else:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against baseline")
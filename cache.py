@@ -0,0 +1,417 @@
+#----------------------------------------------------------------------------
+# Name:        cache.py
+# Purpose:     Persistent On-Disk Cache for Databook API Responses
+# Author:    Drew Fulton
+# Created:    October 2026
+
+import os, json, time, re, hashlib, base64, tempfile, threading
+
+
+class ResponseCache(object):
+    ''' Caches API response bodies on disk, keyed by URL.  Each entry keeps the
+    ETag and Last-Modified validators so an expired entry can be revalidated
+    with a conditional GET instead of downloaded again.  The directory is kept
+    under max_bytes by evicting the least recently used entries.
+    '''
+    def __init__(self, directory, ttls, max_bytes):
+        ''' ttls is a list of (regex, seconds) pairs; the first pattern that
+        matches a URL sets its time to live.  URLs with no match are not cached.
+        '''
+        self.directory = directory
+        self.ttls = [(re.compile(pattern), seconds) for pattern, seconds in ttls]
+        self.max_bytes = max_bytes
+        self.size = SizeLimit(directory, ".json", max_bytes)
+        self.counts = {"hits": 0, "misses": 0, "revalidated": 0, "evictions": 0}
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def ttl_for(self, url):
+        ''' Seconds a response for the URL stays fresh, or 0 if it is not cached
+        '''
+        for pattern, seconds in self.ttls:
+            if pattern.search(url):
+                return seconds
+        return 0
+
+    def path_for(self, url):
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def lock_path(self, url):
+        ''' File locked while a process fetches the URL, so others wait for its
+        response instead of fetching it too
+        '''
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, "locks", f"{digest}.lock")
+
+    def lookup(self, url):
+        ''' Returns the stored entry for the URL, or None.  Reading an entry marks
+        it as recently used.
+        '''
+        path = self.path_for(url)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        if entry.get("url") != url:
+            return None
+        return entry
+
+    def is_fresh(self, entry):
+        return time.time() - entry["stored_at"] < self.ttl_for(entry["url"])
+
+    def content(self, entry):
+        return base64.b64decode(entry["content"])
+
+    def validators(self, entry):
+        ''' Conditional request headers for revalidating an entry
+        '''
+        conditional = {}
+        if entry.get("etag"):
+            conditional["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            conditional["If-Modified-Since"] = entry["last_modified"]
+        return conditional
+
+    def store(self, url, response):
+        ''' Save a 200 response for the URL and evict old entries if needed
+        '''
+        entry = {
+            "url": url,
+            "stored_at": time.time(),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "content_type": response.headers.get("Content-Type"),
+            "content": base64.b64encode(response.content).decode("ascii"),
+        }
+        self.evict(self.write(entry))
+        return entry
+
+    def refresh(self, entry):
+        ''' Mark an entry fresh again after the server answered 304
+        '''
+        entry["stored_at"] = time.time()
+        self.write(entry)
+        self.count("revalidated")
+        return entry
+
+    def write(self, entry):
+        ''' Save an entry.  Returns its size in bytes.
+        '''
+        data = json.dumps(entry).encode("utf-8")
+        write_atomic(self.path_for(entry["url"]), data)
+        return len(data)
+
+    def evict(self, added):
+        ''' Evict old entries if the cache has passed max_bytes with added
+        bytes just written
+        '''
+        for path in self.size.added(added):
+            self.count("evictions")
+
+    def count(self, counter):
+        with self.lock:
+            self.counts[counter] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+class LogoCache(object):
+    ''' Content-addressed disk cache for logo images.  Image bytes are stored
+    once per SHA-256 digest, and a small index entry per URL records which
+    digest it served along with its ETag and Last-Modified validators.  A
+    fresh entry is answered without touching the network; a stale one is
+    revalidated with a conditional GET.  Blobs are evicted least recently
+    used first once they exceed max_bytes.
+    '''
+    def __init__(self, directory, ttl, max_bytes):
+        self.index_dir = os.path.join(directory, "index")
+        self.blob_dir = os.path.join(directory, "blobs")
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.size = SizeLimit(self.blob_dir, ".img", max_bytes)
+        self.counts = {"hits": 0, "misses": 0, "revalidated": 0, "evictions": 0}
+        self.lock = threading.Lock()
+        os.makedirs(self.index_dir, exist_ok=True)
+        os.makedirs(self.blob_dir, exist_ok=True)
+
+    def index_path(self, url):
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.index_dir, f"{digest}.json")
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_dir, f"{digest}.img")
+
+    def lookup(self, url):
+        ''' Returns (entry, image bytes) for the URL.  Either is None when the
+        URL has not been seen or its image has been evicted.
+        '''
+        try:
+            with open(self.index_path(url)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None, None
+        if entry.get("url") != url:
+            return None, None
+        path = self.blob_path(entry["digest"])
+        try:
+            with open(path, "rb") as f:
+                blob = f.read()
+            os.utime(path)
+        except OSError:
+            return entry, None
+        return entry, blob
+
+    def is_fresh(self, entry):
+        return time.time() - entry["fetched_at"] < self.ttl
+
+    def validators(self, entry):
+        conditional = {}
+        if entry.get("etag"):
+            conditional["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            conditional["If-Modified-Since"] = entry["last_modified"]
+        return conditional
+
+    def store(self, url, response):
+        ''' Save a downloaded image.  Identical images from different URLs
+        share one blob.
+        '''
+        digest = hashlib.sha256(response.content).hexdigest()
+        path = self.blob_path(digest)
+        added = 0
+        if not os.path.exists(path):
+            write_atomic(path, response.content)
+            added = len(response.content)
+        entry = {
+            "url": url,
+            "digest": digest,
+            "fetched_at": time.time(),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        write_atomic(self.index_path(url), json.dumps(entry).encode("utf-8"))
+        if added:
+            for path in self.size.added(added):
+                self.count("evictions")
+        return entry
+
+    def refresh(self, entry):
+        ''' Mark an entry fresh again after the server answered 304
+        '''
+        entry["fetched_at"] = time.time()
+        write_atomic(self.index_path(entry["url"]), json.dumps(entry).encode("utf-8"))
+        self.count("revalidated")
+        return entry
+
+    def count(self, counter):
+        with self.lock:
+            self.counts[counter] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+class PeerStore(object):
+    ''' Metric details shared across a peer group.  A details response charts
+    the metric for every company in the peer group, so it is stored once and
+    those companies are pointed at it.  A later company in the same group is
+    then answered from the store instead of the API while the pointer is
+    fresh.
+
+    Peer groups need not be symmetric: B can appear in A's chart while B's
+    own group is different.  So a company is only pointed at a chart whose
+    companies are exactly its own peer group, as last seen in its own
+    response no more than group_ttl ago.  Until then it always fetches its
+    own.  A company's own fresh response is never displaced by a peer's.
+
+    Stored responses are evicted least recently used first once they exceed
+    max_bytes; a pointer to an evicted one is a miss.
+    '''
+    def __init__(self, directory, ttl, group_ttl, max_bytes):
+        self.group_dir = os.path.join(directory, "groups")
+        self.member_dir = os.path.join(directory, "members")
+        self.ttl = ttl
+        self.group_ttl = group_ttl
+        self.max_bytes = max_bytes
+        self.size = SizeLimit(self.group_dir, ".json", max_bytes)
+        # hits are details borrowed from a peer, own those the company fetched
+        # itself in an earlier run
+        self.counts = {"hits": 0, "own": 0, "misses": 0, "evictions": 0}
+        self.lock = threading.Lock()
+        os.makedirs(self.group_dir, exist_ok=True)
+        os.makedirs(self.member_dir, exist_ok=True)
+
+    def member_path(self, metric, company_id):
+        digest = hashlib.sha256(f"{metric}\n{company_id}".encode("utf-8")).hexdigest()
+        return os.path.join(self.member_dir, f"{digest}.json")
+
+    def group_path(self, digest):
+        return os.path.join(self.group_dir, f"{digest}.json")
+
+    def read_member(self, metric, company_id):
+        ''' The pointer for a company's metric, fresh or not, or None.  It
+        holds the group it answers from and the company's own peer group.
+        '''
+        try:
+            with open(self.member_path(metric, company_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_fresh(self, member, now=None):
+        return (now or time.time()) - member["stored_at"] < self.ttl
+
+    def lookup(self, metric, company_id):
+        ''' Returns the details response covering the company's metric, or None
+        '''
+        member = self.read_member(metric, company_id)
+        details = None
+        if member is not None and self.is_fresh(member):
+            path = self.group_path(member["group"])
+            try:
+                with open(path) as f:
+                    details = json.load(f)
+                os.utime(path)
+            except (OSError, ValueError):
+                details = None
+        if details is None:
+            self.count("misses")
+        else:
+            self.count("own" if member["own"] else "hits")
+        return details
+
+    def store(self, metric, company_id, details):
+        ''' Save a details response fetched for company_id, remember its peer
+        group, and point every other company it charts whose own peer group
+        is the same at it
+        '''
+        content = json.dumps(details, sort_keys=True).encode("utf-8")
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.group_path(digest)
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            write_atomic(path, content)
+            for removed in self.size.added(len(content)):
+                self.count("evictions")
+        peers = peer_group(details, company_id)
+        now = time.time()
+        self.write_member(metric, company_id, digest, now, True, peers, now)
+        for peer in peers:
+            if peer == company_id:
+                continue
+            member = self.read_member(metric, peer)
+            if (member is None or member.get("peers") != peers
+                    or now - member["peers_at"] >= self.group_ttl):
+                continue
+            if member["own"] and self.is_fresh(member, now):
+                continue
+            self.write_member(metric, peer, digest, now, False, peers, member["peers_at"])
+
+    def write_member(self, metric, company_id, group, stored_at, own, peers, peers_at):
+        member = {"group": group, "stored_at": stored_at, "own": own, "peers": peers, "peers_at": peers_at}
+        write_atomic(self.member_path(metric, company_id), json.dumps(member).encode("utf-8"))
+
+    def count(self, counter):
+        with self.lock:
+            self.counts[counter] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+def peer_group(details, company_id):
+    ''' Sorted keys of the companies a details response charts, the company
+    it was fetched for included.  Companies are keyed by id, or by name when
+    the chart has no id for them.
+    '''
+    peers = {company_id}
+    for chart in details.get("chart", ()):
+        for company in chart.get("companies", ()):
+            peers.add(company.get("_id") or f"name:{company.get('name')}")
+    return sorted(peers)
+
+
+def write_atomic(path, data):
+    ''' Write a file atomically so concurrent workers never read half of it
+    '''
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+class SizeLimit(object):
+    ''' Keeps the files with one suffix in a directory under max_bytes without
+    scanning the directory on every write.  A running total starts from one
+    scan and adds what this process writes.  Only once it passes max_bytes
+    is the directory scanned again, counting what other processes wrote, and
+    the least recently used files evicted down to low_water of max_bytes, so
+    the writes that follow need no scan.
+    '''
+    def __init__(self, directory, suffix, max_bytes, low_water=0.9):
+        self.directory = directory
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.total = None
+        self.lock = threading.Lock()
+
+    def added(self, size):
+        ''' Count a file of size bytes just written.  Returns the paths evicted.
+        '''
+        with self.lock:
+            if self.total is not None:
+                self.total += size
+                if self.total <= self.max_bytes:
+                    return []
+            removed, self.total = evict_lru(
+                self.directory, self.suffix, self.max_bytes, int(self.max_bytes * self.low_water)
+            )
+            return removed
+
+
+def evict_lru(directory, suffix, max_bytes, target=None):
+    ''' Once the files with the given suffix take more than max_bytes, remove
+    the least recently used until they fit in target, max_bytes by default.
+    Returns (paths removed, bytes left).
+    '''
+    entries = []
+    total = 0
+    for name in os.listdir(directory):
+        if not name.endswith(suffix):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+    removed = []
+    if total <= max_bytes:
+        return removed, total
+    if target is None:
+        target = max_bytes
+    entries.sort()
+    for mtime, size, path in entries:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed.append(path)
+    return removed, total
@@ -0,0 +1,148 @@
+#----------------------------------------------------------------------------
+# Name:        catalog.py
+# Purpose:     Searchable Local Index of the Databook Company Catalogue
+# Author:    Drew Fulton
+# Created:    October 2026
+
+import os, re, json, time, bisect, difflib, hashlib, threading
+
+import cache
+
+
+class CompanyIndex(object):
+    ''' Every company in the catalogue by id, with its name and aliases, kept
+    on disk so the CLI can search it without downloading the listing first.
+    Names and aliases are indexed by the start of each word for prefix
+    search; close misspellings are found with difflib when prefixes give too
+    few results.
+    '''
+    def __init__(self, path, ttl):
+        ''' ttl is how many seconds the index is used before it is refreshed
+        '''
+        self.path = path
+        self.ttl = ttl
+        self.companies = {}
+        self.digest = None
+        self.refreshed_at = 0
+        self.keys = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        ''' Read the index saved at path, if there is one
+        '''
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return self
+        with self.lock:
+            self.companies = {c["id"]: c for c in saved.get("companies", [])}
+            self.digest = saved.get("digest")
+            self.refreshed_at = saved.get("refreshed_at", 0)
+            self.keys = None
+        return self
+
+    def save(self):
+        with self.lock:
+            saved = {
+                "digest": self.digest,
+                "refreshed_at": self.refreshed_at,
+                "companies": list(self.companies.values()),
+            }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        cache.write_atomic(self.path, json.dumps(saved).encode("utf-8"))
+
+    def __len__(self):
+        return len(self.companies)
+
+    def is_stale(self):
+        return time.time() - self.refreshed_at >= self.ttl
+
+    def update(self, records, digest=None):
+        ''' Replace the index with a full listing of records.  A listing with
+        the same digest as last time is not read at all, and the search keys
+        are only rebuilt if a company was added, removed or renamed.  Returns
+        True if anything changed.
+        '''
+        changed = False
+        if digest is None or digest != self.digest:
+            companies = {record["id"]: record for record in records}
+            with self.lock:
+                changed = companies != self.companies
+                if changed:
+                    self.companies = companies
+                    self.keys = None
+                self.digest = digest
+        self.refreshed_at = time.time()
+        self.save()
+        return changed
+
+    def search_keys(self):
+        ''' (companies, keys) as they stand together, so a refresh on another
+        thread cannot swap one without the other.  keys are sorted (key, rank,
+        id) triples.  Each key is a name or alias from one of its words to the
+        end, and rank is the word it starts at, so 0 is the whole name or
+        alias.
+        '''
+        with self.lock:
+            if self.keys is None:
+                keys = []
+                for company in self.companies.values():
+                    for text in [company["name"]] + company.get("aliases", []):
+                        words = normalize(text).split(" ")
+                        for start in range(len(words)):
+                            keys.append((" ".join(words[start:]), start, company["id"]))
+                keys.sort()
+                self.keys = keys
+            return self.companies, self.keys
+
+    def search(self, query, fuzzy_below=10):
+        ''' Companies matching query, best first: an exact id, then names or
+        aliases starting with it, then words starting with it, then close
+        misspellings if there were fewer than fuzzy_below matches so far.  An
+        empty query lists everything by name.
+        '''
+        company_id = query.strip()
+        query = normalize(query)
+        companies, keys = self.search_keys()
+        if not query:
+            return sorted(companies.values(), key=lambda c: c["name"].lower())
+        matches = {}
+        if company_id in companies:
+            matches[company_id] = (-1, "")
+        for key, rank, company_id in keys[bisect.bisect_left(keys, (query,)):]:
+            if not key.startswith(query):
+                break
+            best = matches.get(company_id)
+            if best is None or (rank, key) < best:
+                matches[company_id] = (rank, key)
+        results = sorted(matches, key=lambda c: (matches[c], companies[c]["name"]))
+        if len(results) < fuzzy_below:
+            names = {}
+            for key, rank, company_id in keys:
+                if rank == 0:
+                    names.setdefault(key, company_id)
+            for name in difflib.get_close_matches(query, names, n=fuzzy_below, cutoff=0.6):
+                if names[name] not in matches:
+                    matches[names[name]] = None
+                    results.append(names[name])
+        return [companies[c] for c in results]
+
+
+def normalize(text):
+    ''' Lower case words separated by single spaces, without punctuation
+    '''
+    return re.sub(r"[^a-z0-9]+", " ", text.lower()).strip()
+
+
+def company_record(company):
+    ''' The index entry for one company in the API listing
+    '''
+    aliases = list(company.get("aliases") or [])
+    if company.get("ticker"):
+        aliases.append(company["ticker"])
+    return {"id": company["_id"], "name": company.get("name") or company["_id"], "aliases": aliases}
+
+
+def listing_digest(content):
+    return hashlib.sha256(content).hexdigest()
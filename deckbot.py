@@ -6,21 +6,157 @@
 # Author:       Drew Fulton
 # Created:      April 2020
 
-import argparse
+import argparse, os, sys, cProfile
 
 import presenters
 import models
 import views
+import service
+import tracing
 
 ''' Launches the entire application
 '''
 
 parser = argparse.ArgumentParser()
+parser.add_argument("command", nargs="?", choices=["serve", "sync"],
+	help="serve: run an HTTP service returning decks at GET /decks/{company_id}; "
+	"sync: copy companies (--id, --ids-file or, by default, all) that have reported "
+	"since the last sync into the offline snapshot and queue their decks")
 parser.add_argument("--id", action='store',
 	help="Enter the ID of the Company", type=str, required=False)
-args = parser.parse_args()
+parser.add_argument("--ids-file", action='store',
+	help="Create decks for every Company ID listed in a file, one per line",
+	type=str, required=False)
+parser.add_argument("--all", action='store_true',
+	help="Create decks for every Company available from Databook")
+parser.add_argument("--combined", action='store_true',
+	help="With --ids-file or --all, put every company's slides into one deck "
+	"(default: exports/combined.pptx)")
+parser.add_argument("--workers", action='store',
+	help="Number of worker processes for batch or serve mode (default: one per core), "
+	"with --combined how many companies are fetched ahead (default: 4), "
+	"or for sync how many are fetched at once (default: 8)",
+	type=int, required=False)
+parser.add_argument("--host", action='store', default="127.0.0.1",
+	help="Address for serve mode to listen on (default: 127.0.0.1)", type=str)
+parser.add_argument("--port", action='store', default=8080,
+	help="Port for serve mode to listen on (default: 8080)", type=int)
+parser.add_argument("--output", action='store',
+	help="Where to write decks: a path template using {id} and {name} "
+	"(default: exports/{name}-{id}.pptx), or - for stdout",
+	type=str, required=False)
+parser.add_argument("--force", action='store_true',
+	help="Rebuild decks even when nothing they show has changed since the last run")
+parser.add_argument("--full", action='store_true',
+	help="With sync, fetch every company in full, not just those that have reported")
+parser.add_argument("--prerender", action='store_true',
+	help="With sync, then render every queued deck from the snapshot")
+parser.add_argument("--offline", action='store_true',
+	help="Render from the snapshot made by the sync command, without the API")
+parser.add_argument("--endpoint", action='store',
+	help="Base URL of the Databook API, e.g. a local standin.py server",
+	type=str, required=False)
+parser.add_argument("--record", action='store',
+	help="Save every API response into this directory as fixtures for standin.py",
+	type=str, required=False)
+parser.add_argument("--profile", action='store',
+	help="Write timing spans for every API call and slide builder to this file: "
+	"a Chrome trace if it ends in .json, otherwise JSON lines",
+	type=str, required=False)
+parser.add_argument("--cprofile", action='store',
+	help="Also save cProfile stats for the main process to this file",
+	type=str, required=False)
 
-if args.id:
-	presenters.DeckbotPresenter(company_id=args.id, view=views.DeckbotCLI())
-else:
-	presenters.DeckbotPresenter(view=views.DeckbotCLI())
\ No newline at end of file
+
+def read_ids_file(path):
+	''' Read Company IDs from a file, skipping blank lines and # comments
+	'''
+	with open(path) as f:
+		lines = [line.strip() for line in f]
+	return [line for line in lines if line and not line.startswith("#")]
+
+
+def main():
+	''' Run the command line given to deckbot.py
+	'''
+	args = parser.parse_args()
+
+	if args.endpoint:
+		models.endpoint = args.endpoint.rstrip("/")
+	if args.record:
+		models.start_recording(os.path.abspath(args.record))
+	if args.offline and args.command == "sync":
+		parser.error("sync fills the snapshot from the API and cannot be run --offline")
+	if args.offline:
+		models.start_offline()
+
+	if args.output == "-" and (args.ids_file or args.all or args.command == "sync"):
+		parser.error("--output - writes a single deck and cannot be used in batch mode")
+	if args.output == "-" and not args.id:
+		parser.error("--output - needs --id, since picking a company prompts on stdout")
+	if args.combined and not (args.ids_file or args.all):
+		parser.error("--combined needs the companies from --ids-file or --all")
+	target = args.output
+	if target and target != "-":
+		target = os.path.abspath(target)
+
+	if args.profile:
+		tracing.start(os.path.abspath(args.profile))
+	profiler = cProfile.Profile() if args.cprofile else None
+	if profiler is not None:
+		profiler.enable()
+
+	try:
+		if args.command == "serve":
+			server = service.DeckService((args.host, args.port), workers=args.workers)
+			print(f"Serving decks at http://{args.host}:{args.port}/decks/<company_id>")
+			server.serve()
+		elif args.command == "sync":
+			if args.id:
+				company_ids = [args.id]
+			elif args.ids_file:
+				company_ids = read_ids_file(args.ids_file)
+			else:
+				company_ids = (c["id"] for c in models.iter_companies())
+			sync = presenters.SyncPresenter(view=views.DeckbotCLI(), workers=args.workers)
+			results = sync.run(company_ids, full=args.full)
+			if args.prerender:
+				results += sync.prerender(target=target, force=args.force)
+			if not all(r.ok for r in results):
+				sys.exit(1)
+		elif args.ids_file or args.all:
+			if args.ids_file:
+				company_ids = read_ids_file(args.ids_file)
+			else:
+				company_ids = (c["id"] for c in models.iter_companies())
+			if args.combined:
+				batch = presenters.CombinedPresenter(
+					view=views.DeckbotCLI(), target=target, lookahead=args.workers or 4
+				)
+			else:
+				batch = presenters.BatchPresenter(
+					view=views.DeckbotCLI(), workers=args.workers, target=target, force=args.force
+				)
+			results = batch.run(company_ids)
+			if not all(r.ok for r in results):
+				sys.exit(1)
+		elif args.id:
+			presenters.DeckbotPresenter(view=views.DeckbotCLI(), force=args.force).run(
+				company_id=args.id, target=target
+			)
+		else:
+			presenters.DeckbotPresenter(view=views.DeckbotCLI(), force=args.force).run(
+				target=target
+			)
+	except models.DatabookError as e:
+		print(f"Something went wrong talking to Databook: {e}", file=sys.stderr)
+		sys.exit(1)
+	finally:
+		if profiler is not None:
+			profiler.disable()
+			profiler.dump_stats(args.cprofile)
+		tracing.finish()
+
+
+if __name__ == "__main__":
+	main()
@@ -4,110 +4,1290 @@
 # Author:    Drew Fulton
 # Created:    April 2020
 
-import requests, json, configparser
+import requests, json, codecs, configparser, random, time, os, re, base64, tempfile, threading, queue, warnings
+import numpy as np
+from requests.adapters import HTTPAdapter
+import cache
+import catalog
+import snapshot
+import standin
+import tracing
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; token refreshes are then only
+    # single-flight within a process.
+    fcntl = None
 
 endpoint = "https://api.trydatabook.com"
-headers = {"Authorization": "Bearer "}
+transport = None
+transport_pid = None
+# Directory that successful GETs are recorded into as stand-in fixtures, if any
+record_directory = None
+# Fraction of the [api] request rate this process may use.  Pools of worker
+# processes split the rate between them, see worker_settings.
+rate_share = 1.0
+
+# Tuning for the HTTP transport.  Any of these can be overridden in an [api]
+# section of config.ini.
+api_defaults = {
+    "connect_timeout": 5.0,
+    "read_timeout": 30.0,
+    "max_retries": 4,
+    "backoff_factor": 0.5,
+    "backoff_max": 30.0,
+    "pool_size": 10,
+    "rate_limit": 10.0,
+    "rate_limit_min": 0.5,
+    "rate_limit_max": 50.0,
+    "rate_limit_burst": 10,
+}
+
+token_manager = None
+
+# Settings for the persisted security token, overridable in an [auth] section
+# of config.ini.  token_lifetime is only used when the token does not carry
+# its own expiry.
+auth_defaults = {
+    "token_file": os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), ".cache", "token.json"
+    ),
+    "refresh_margin": 300,
+    "token_lifetime": 3600,
+}
+
+response_cache = None
+response_cache_loaded = False
+logo_cache = None
+logo_cache_loaded = False
+company_index = None
+# Metric details shared across peer groups, set by start_peer_sharing
+peer_store = None
+# SnapshotStore that answers every read instead of the API, set by start_offline
+snapshot_store = None
+
+# Where the offline snapshot is kept, overridable in a [snapshot] section of
+# config.ini
+snapshot_defaults = {
+    "path": os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "snapshot.sqlite3"),
+}
+
+# Settings for the on-disk response cache, overridable in a [cache] section of
+# config.ini.  TTLs are in seconds; Databook data changes at most quarterly and
+# expired entries are revalidated cheaply with a conditional GET.
+cache_defaults = {
+    "enabled": True,
+    "directory": os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"),
+    "max_mb": 200.0,
+    "companies_ttl": 86400,
+    "overview_ttl": 86400,
+    "metrics_ttl": 604800,
+    "metric_details_ttl": 86400,
+    "peer_group_ttl": 604800,
+    "peer_max_mb": 50.0,
+    "logo_ttl": 2592000,
+    "logo_max_mb": 50.0,
+}
+
+
+class DatabookError(Exception):
+    ''' Base class for every error raised while talking to the Databook API
+    '''
+
+
+class DatabookHTTPError(DatabookError):
+    ''' The Databook API answered with a status code we cannot use
+    '''
+    def __init__(self, status_code, url, message=None):
+        self.status_code = status_code
+        self.url = url
+        if message is None:
+            message = f"Databook API returned {status_code} for {url}"
+        super().__init__(message)
+
+    def __reduce__(self):
+        # Keep the status code when raised inside a worker process.
+        return (type(self), (self.status_code, self.url, str(self)))
+
+
+class DatabookAuthError(DatabookError):
+    ''' Logging in failed or the API kept rejecting a fresh token
+    '''
+
+
+class DatabookConnectionError(DatabookError):
+    ''' The Databook API could not be reached, even after retrying
+    '''
+
+
+class DatabookRequestError(DatabookError):
+    ''' A request could not be sent at all, such as one to a malformed URL or
+    one caught in a redirect loop
+    '''
 
 
 class Company(object):
-    ''' Object to incapsulate the company's data
+    ''' Object to incapsulate the company's data.  Only the overview fields the
+    slides use are kept.
     '''
+    # Overview fields copied as-is from the API
+    overview_fields = (
+        "description",
+        "employees",
+        "currency",
+        "type",
+        "website",
+        "address",
+        "currentQuarter",
+        "quarterEnd",
+        "fiscalYearEnd",
+        "logoUrl",
+    )
+    __slots__ = ("id", "name", "latestRevenue", "latestRevenueGrowth", "logo_image",
+        "_metrics") + overview_fields
+
     def __init__(self, company_id, company_name=None):
         self.id = company_id
-       	self.name = company_name
+        self.name = company_name
+        self.latestRevenue = None
+        self.latestRevenueGrowth = None
+        self.logo_image = None
+        self._metrics = None
+        for field in self.overview_fields:
+            setattr(self, field, None)
+
+    @property
+    def metrics(self):
+        ''' MetricIndex of the metrics available for the company, fetched the
+        first time it is used
+        '''
+        if self._metrics is None:
+            self._metrics = self.get_company_metrics()
+        return self._metrics
     
     def get_company_overview(self):
         ''' Gets overview information from Databook API given a specfic Company object
         and returns a Company object
         '''
+        if snapshot_store is not None:
+            self.load_overview(from_snapshot(snapshot_store.overview(self.id), f"company {self.id}"))
+            return self
         path = f"/api/companies/{self.id}"
         response = get_api(f"{endpoint}{path}")
-        overview = json.loads(response.content)
-        for item in overview:
-            setattr(self, item, overview[item])
+        self.load_overview(json.loads(response.content))
+        return self
+
+    def load_overview(self, overview):
+        ''' Keep the fields of an overview response that the slides use
+        '''
+        self.name = overview.get("name", self.name)
+        for field in self.overview_fields:
+            setattr(self, field, overview.get(field))
+        self.latestRevenue = ReportedValue.from_json(overview.get("latestRevenue"))
+        self.latestRevenueGrowth = ReportedValue.from_json(
+            overview.get("latestRevenueGrowth")
+        )
 
     def get_company_metrics(self):
-        ''' Gets a list of all metrics availble for a given Company object. 
-        Returns List
+        ''' Gets all metrics availble for a given Company object. 
+        Returns a MetricIndex.  Metric details are not fetched until used.
         '''
-        metric_list = []
-        metric_list_plain = []
+        if snapshot_store is not None:
+            return self.load_metrics(
+                from_snapshot(snapshot_store.metrics(self.id), f"metric list for company {self.id}")
+            )
         response = get_api(f"{endpoint}/api/companies/{self.id}/metrics")
-        metrics = json.loads(response.content)
-        for metric in metrics:
-            metric_list.append(Metric(metric, self.id))
-            metric_list_plain.append(metric["name"])
-        return metric_list
+        return self.load_metrics(json.loads(response.content))
+
+    def load_metrics(self, metrics):
+        ''' Index a metric list response and keep it as the company's metrics
+        '''
+        self._metrics = MetricIndex(Metric(metric, self.id) for metric in metrics)
+        return self._metrics
+
+
+class ReportedValue(object):
+    ''' A figure reported for a fiscal quarter, such as latest revenue
+    '''
+    __slots__ = ("quarter", "year", "value_usd")
+
+    def __init__(self, quarter, year, value_usd=None):
+        self.quarter = quarter
+        self.year = year
+        self.value_usd = value_usd
+
+    @classmethod
+    def from_json(cls, data):
+        if not data:
+            return None
+        return cls(data.get("quarter"), data.get("year"), data.get("valueUSD"))
+
+
+class MetricIndex(object):
+    ''' A company's metrics, looked up by metric name or id.  Iterating yields
+    the Metric objects in the order the API listed them.
+    '''
+    __slots__ = ("metrics", "by_name", "by_id")
+
+    def __init__(self, metrics):
+        self.metrics = list(metrics)
+        self.by_name = {m.name: m for m in self.metrics}
+        self.by_id = {m.id: m for m in self.metrics}
+
+    def __getitem__(self, key):
+        if key in self.by_name:
+            return self.by_name[key]
+        return self.by_id[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in self.by_name or key in self.by_id
+
+    def __iter__(self):
+        return iter(self.metrics)
+
+    def __len__(self):
+        return len(self.metrics)
         
             
 class Metric(object):
-    ''' Object to hold company metrics
+    ''' Object to hold company metrics.  Details such as the chart are fetched
+    the first time one of them is read, then kept.
     '''
+    __slots__ = ("company_id", "id", "name", "details_loaded", "_description", "_chart")
+
     def  __init__(self, metric, company_id):
         self.company_id = company_id
-        for item in metric:
-            setattr(self, item, metric[item])
-        self.id = self._id
+        self.id = metric["_id"]
+        self.name = metric.get("name")
+        self.details_loaded = False
+        self._description = metric.get("description")
+        self._chart = None
+
+    @property
+    def description(self):
+        if self._description is None:
+            self.get_metric_details()
+        return self._description
+
+    @property
+    def chart(self):
+        ''' Tuple of PeerCharts from the metric details
+        '''
+        self.get_metric_details()
+        return self._chart
     
     def get_metric_details(self):
+        ''' Fetch the metric details from the Databook API, once.  While peer
+        sharing is on, details already fetched for a peer with the same peer
+        group are used instead.
+        Offline, they are read from the snapshot.
+        '''
+        if self.details_loaded:
+            return
+        if snapshot_store is not None:
+            self.load_details(from_snapshot(
+                snapshot_store.details(self.name, self.company_id),
+                f"{self.name} details for company {self.company_id}"
+            ))
+            return
+        if peer_store is not None:
+            details = peer_store.lookup(self.name, self.company_id)
+            if details is not None:
+                self.load_details(details)
+                return
         path = f"{endpoint}/api/companies/{self.company_id}/metrics/{self.id}"
         response = get_api(path)
         details = json.loads(response.content)
-        for d in details:        
-            setattr(self, d, details[d])    
-    
+        self.load_details(details)
+        if peer_store is not None:
+            peer_store.store(self.name, self.company_id, details)
+
+    def load_details(self, details):
+        ''' Keep the fields of a metric details response that the slides use
+        '''
+        self.name = details.get("name", self.name)
+        self._description = details.get("description", self._description) or ""
+        self._chart = tuple(PeerChart.from_json(c) for c in details.get("chart", ()))
+        self.details_loaded = True
+
+
+class PeerChart(object):
+    ''' One chart from a metric's details as a NumPy peer x period matrix.
+    Each company in the peer group is a row and each period label a column,
+    with NaN where a company has no value.  Peer statistics are computed on
+    the matrix with vectorized operations.
+    '''
+    __slots__ = ("names", "ids", "labels", "periods", "groups", "values", "rows")
+
+    def __init__(self, names, ids, labels, periods, groups, values):
+        self.names = names
+        self.ids = ids
+        self.labels = labels
+        self.periods = periods
+        self.groups = groups
+        self.values = values
+        self.rows = {name: row for row, name in enumerate(names)}
+
+    @classmethod
+    def from_json(cls, chart):
+        ''' Build from the API form, a list of companies each holding a list of
+        {label, period, groups, value} points.  Columns follow the order of
+        the first company's points.
+        '''
+        companies = chart.get("companies", [])
+        columns = {}
+        labels, periods, groups = [], [], []
+        rows, cols, points = [], [], []
+        for row, c in enumerate(companies):
+            for p in c["data"]:
+                if p["label"] not in columns:
+                    columns[p["label"]] = len(labels)
+                    labels.append(p["label"])
+                    periods.append(p.get("period"))
+                    groups.append(frozenset(p.get("groups") or ()))
+                if p.get("value") is not None:
+                    rows.append(row)
+                    cols.append(columns[p["label"]])
+                    points.append(p["value"])
+        values = np.full((len(companies), len(labels)), np.nan)
+        values[rows, cols] = points
+        return cls(
+            tuple(c["name"] for c in companies),
+            tuple(c.get("_id") for c in companies),
+            tuple(labels),
+            tuple(periods),
+            tuple(groups),
+            values
+        )
+
+    def row(self, name):
+        ''' All values for one company, NaN where it has none
+        '''
+        return self.values[self.rows[name]]
+
+    def column(self, index):
+        ''' (names, values) for one column sorted by ascending value, skipping
+        companies with no value
+        '''
+        values = self.values[:, index]
+        present = np.flatnonzero(~np.isnan(values))
+        order = present[np.argsort(values[present], kind="stable")]
+        return [self.names[i] for i in order], values[order]
+
+    def group_columns(self, group):
+        ''' Indexes of the columns tagged with a group, e.g. "Last 3 years"
+        '''
+        return [i for i, g in enumerate(self.groups) if group in g]
+
+    def quartile(self, name, index):
+        ''' Quartile of the company within a column: 1 for the top quarter of
+        peers through 4 for the bottom, using the column's 25th, 50th and 75th
+        percentiles as the boundaries.  None if the company has no value.
+        '''
+        value = self.row(name)[index]
+        if np.isnan(value):
+            return None
+        bounds = np.nanpercentile(self.values[:, index], [75, 50, 25])
+        return 1 + int(np.count_nonzero(value < bounds))
+
+    def medians(self, columns):
+        ''' Peer median of each column, ignoring missing values.  NaN for a
+        column with no values at all.
+        '''
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            return np.nanmedian(self.values[:, columns], axis=0)
+
+    def growth(self, first, last):
+        ''' Fractional change from column first to column last for every peer.
+        An unchanged value is 0 growth, even from 0; NaN where either value
+        is missing.
+        '''
+        before, after = self.values[:, first], self.values[:, last]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            change = (after - before) / before
+        change[after == before] = 0
+        return change
+
+
 def get_all_companies(offline=False):
     ''' Gets all companies from Databook API and returns a list of Company objects.
-    Option offline is used to pull from hard coded sample list rather than from API
+    Option offline is used to pull from the snapshot, or from a hard coded
+    sample list if nothing has been synced, rather than from API
     '''
     all_companies = []
     if offline:
-        for company in test_company_list:
-            all_companies.append(Company(company[1], company[0]))
+        synced = get_snapshot_store().company_records()
+        for company_id, name in synced or [(c[1], c[0]) for c in test_company_list]:
+            all_companies.append(Company(company_id, name))
     else:
-        response = get_api(f"{endpoint}/api/companies/")
-        companies = json.loads(response.content)
-        for company in companies:
-            all_companies.append(Company(company['_id'], company['name']))
+        for company in iter_companies():
+            all_companies.append(Company(company["id"], company["name"]))
     return all_companies
-    
 
-def get_api(path):
-    ''' Performs a GET from the Databook API.  If token is expired, it will renew.
-    If another error occurs, error code is printed and the program is exited. 
+
+# How many listing records are read ahead of the caller, at a few hundred
+# bytes each
+listing_read_ahead = 2000
+
+
+def iter_companies():
+    ''' Yields an index record (id, name, aliases) for each company in the
+    listing while the response is still downloading, so callers can start on
+    the first companies straight away.  Up to listing_read_ahead records are
+    read ahead of the caller, so memory stays flat however long the listing.
+    If the API pages the listing with Link: rel="next" headers, the pages
+    are followed in turn.  Offline, the companies in the snapshot are listed
+    instead.
     '''
-    global headers
-    response = requests.get(path, headers=headers)
-    if response.status_code == 200:
+    if snapshot_store is not None:
+        for company_id, name in snapshot_store.company_records():
+            yield {"id": company_id, "name": name or company_id, "aliases": []}
+        return
+    records = queue.Queue(maxsize=listing_read_ahead)
+    stop = threading.Event()
+    threading.Thread(target=download_listing, args=(records, stop), daemon=True).start()
+    try:
+        while True:
+            record = records.get()
+            if record is None:
+                return
+            if isinstance(record, Exception):
+                raise record
+            yield record
+    finally:
+        stop.set()
+
+
+def download_listing(records, stop):
+    ''' Put the index record of every company in the listing on records as it
+    downloads, followed by None, or by the error that stopped it.  This runs
+    on a thread of its own, so the connection keeps reading while a batch
+    works through the records already queued.  Once records is full it waits
+    for the caller, and it gives up when stop is set.
+    '''
+    try:
+        url = f"{endpoint}/api/companies/"
+        while url:
+            with tracing.span("GET", "api", url=url_template(url), stream=True):
+                response = get_authorized(url, stream=True)
+                tracing.annotate(status=response.status_code)
+                check_response(response)
+            try:
+                for company in iter_json_array(response.iter_content(chunk_size=65536)):
+                    if not offer(records, stop, catalog.company_record(company)):
+                        return
+            except requests.RequestException as e:
+                raise DatabookConnectionError(f"The companies listing was cut off: {e}") from e
+            finally:
+                response.close()
+            url = response.links.get("next", {}).get("url")
+    except Exception as e:
+        offer(records, stop, e)
+    else:
+        offer(records, stop, None)
+
+
+def offer(records, stop, item):
+    ''' Put item on the bounded queue records, waiting while it is full.
+    Returns False without putting it if stop is set first.
+    '''
+    while not stop.is_set():
+        try:
+            records.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def iter_json_array(chunks):
+    ''' Yields the items of a JSON array of objects from its body in chunks
+    of bytes, decoding each item as soon as all of it has arrived
+    '''
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    started = False
+    for chunk in chunks:
+        buffer += text.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buffer):
+                break
+            if not started:
+                if buffer[pos] != "[":
+                    raise DatabookError("Expected a JSON array from the API")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                # The rest of this item has not arrived yet
+                break
+            yield item
+        buffer = buffer[pos:]
+    raise DatabookError("The API response ended before the end of its JSON array")
+
+
+def get_company_index(background=True):
+    ''' Returns the CompanyIndex saved under the cache directory.  An empty
+    index is filled from the companies listing before returning; a stale one
+    is returned as it is and refreshed in a background thread, unless
+    background is false.  Offline, the index lists the snapshot's companies.
+    '''
+    global company_index
+    if snapshot_store is not None:
+        if company_index is None:
+            company_index = catalog.CompanyIndex(snapshot_store.path + ".companies.json", 0)
+            company_index.update(iter_companies())
+        return company_index
+    if company_index is None:
+        settings = get_settings("cache", cache_defaults)
+        company_index = catalog.CompanyIndex(
+            os.path.join(settings["directory"], "companies.json"),
+            settings["companies_ttl"]
+        ).load()
+    if not len(company_index) or not background:
+        refresh_company_index(company_index)
+    elif company_index.is_stale():
+        threading.Thread(
+            target=refresh_company_index, args=(company_index, True), daemon=True
+        ).start()
+    return company_index
+
+
+def refresh_company_index(index, quiet=False):
+    ''' Update a CompanyIndex from the companies listing.  The listing is only
+    parsed if its body differs from the one the index was built from.  With
+    quiet, a failure leaves the index as it was instead of raising.
+    '''
+    try:
+        response = get_api(f"{endpoint}/api/companies/")
+        index.update(
+            company_records(response.content), catalog.listing_digest(response.content)
+        )
+    except DatabookError:
+        if not quiet:
+            raise
+
+
+def company_records(content):
+    ''' Index entries for a companies listing body
+    '''
+    for company in json.loads(content):
+        yield catalog.company_record(company)
+
+
+class CachedResponse(object):
+    ''' Stands in for a requests.Response when the body comes from the cache
+    '''
+    status_code = 200
+    from_cache = True
+
+    def __init__(self, url, content, content_type=None):
+        self.url = url
+        self.content = content
+        self.headers = {"Content-Type": content_type} if content_type else {}
+
+
+class Transport(object):
+    ''' Shared HTTP transport for the Databook API.  Keeps a pool of keep-alive
+    connections so repeated calls skip the TCP and TLS handshake, and retries
+    throttled or unavailable responses with jittered exponential backoff.
+    '''
+    # 500 is how the API rejects an unknown company_id, so it is not retried.
+    retry_statuses = frozenset((429, 502, 503, 504))
+    # Failures of the connection or of the response body in transit, which
+    # another attempt may not hit.  Any other RequestException is not retried.
+    retry_errors = (
+        requests.ConnectionError,
+        requests.Timeout,
+        requests.exceptions.ChunkedEncodingError,
+        requests.exceptions.ContentDecodingError,
+    )
+
+    def __init__(
+        self,
+        connect_timeout=5.0,
+        read_timeout=30.0,
+        max_retries=4,
+        backoff_factor=0.5,
+        backoff_max=30.0,
+        pool_size=10,
+        rate_limit=10.0,
+        rate_limit_min=0.5,
+        rate_limit_max=50.0,
+        rate_limit_burst=10
+        ):
+        ''' Requests to the API endpoint are paced by a RateLimiter starting at
+        rate_limit requests a second; 0 turns it off.
+        '''
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.limiter = None
+        if rate_limit > 0:
+            self.limiter = RateLimiter(
+                rate_limit, rate_limit_min, rate_limit_max, rate_limit_burst
+            )
+
+    def request(self, method, url, **kwargs):
+        ''' Send a request, retrying connection failures and retryable status
+        codes.  Returns the last response once retries are exhausted.  Every
+        failure to get a response raises a DatabookError.
+        '''
+        kwargs.setdefault("timeout", self.timeout)
+        limiter = self.limiter if url.startswith(endpoint) else None
+        attempt = 0
+        while True:
+            if limiter is not None:
+                limiter.acquire()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except self.retry_errors as e:
+                if attempt >= self.max_retries:
+                    raise DatabookConnectionError(f"Could not reach {url}: {e}") from e
+                delay = self.backoff(attempt)
+            except requests.RequestException as e:
+                raise DatabookRequestError(f"Could not request {url}: {e}") from e
+            else:
+                if limiter is not None and response.status_code == 429:
+                    limiter.throttled(parse_retry_after(response.headers.get("Retry-After")))
+                elif limiter is not None:
+                    limiter.succeeded()
+                if response.status_code not in self.retry_statuses:
+                    tracing.annotate(retries=attempt)
+                    return response
+                if attempt >= self.max_retries:
+                    tracing.annotate(retries=attempt)
+                    return response
+                if limiter is not None and response.status_code == 429:
+                    # The limiter already holds the next attempt for any
+                    # Retry-After and paces it at the lowered rate.
+                    delay = 0
+                else:
+                    delay = self.backoff(attempt, response.headers.get("Retry-After"))
+                response.close()
+            attempt += 1
+            time.sleep(delay)
+
+    def backoff(self, attempt, retry_after=None):
+        ''' Seconds to wait before the next attempt.  Honours a numeric
+        Retry-After header, otherwise uses full-jitter exponential backoff.
+        '''
+        seconds = parse_retry_after(retry_after)
+        if seconds is not None:
+            return min(seconds, self.backoff_max)
+        ceiling = min(self.backoff_max, self.backoff_factor * 2 ** attempt)
+        return random.uniform(0, ceiling)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+class RateLimiter(object):
+    ''' Token bucket pacing requests to the Databook API.  The rate adapts to
+    the server: a 429 halves it and, with a Retry-After, holds every request
+    until then, while each successful response raises it again additively, up
+    to max_rate.  One limiter is shared by all threads of a process, and each
+    process of a worker pool paces its share of the rate (see rate_share).
+    '''
+    def __init__(self, rate, min_rate, max_rate, burst):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        ''' Wait until a request may be sent
+        '''
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self, retry_after=None):
+        ''' The server answered 429
+        '''
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            tracing.annotate(rate_limit=self.rate)
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+
+
+def parse_retry_after(value):
+    ''' Seconds from a numeric Retry-After header, or None
+    '''
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        return None
+
+
+class SingleFlight(object):
+    ''' Lets identical calls that overlap share one execution.  The first
+    caller for a key runs the function; callers arriving while it runs wait
+    for it and get the same result, or the same exception.
+    '''
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, function, *args):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {"done": threading.Event()}
+        if not leader:
+            call["done"].wait()
+            tracing.annotate(coalesced=True)
+            if "error" in call:
+                raise call["error"]
+            return call["result"]
+        try:
+            call["result"] = function(*args)
+            return call["result"]
+        except BaseException as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call["done"].set()
+
+
+# Identical get_api calls running at once in this process
+in_flight = SingleFlight()
+
+
+class RecordingTransport(Transport):
+    ''' Transport that also saves every successful GET as a fixture that
+    standin.StandinServer can replay offline
+    '''
+    def __init__(self, directory, **settings):
+        super().__init__(**settings)
+        self.directory = directory
+
+    def request(self, method, url, **kwargs):
+        response = super().request(method, url, **kwargs)
+        if method == "GET" and response.status_code == 200:
+            standin.save_fixture(self.directory, url, response)
         return response
+
+
+def get_transport():
+    ''' Returns the shared Transport, creating it from config.ini on first use.
+    A forked worker process gets its own so pooled sockets are never shared.
+    Its request rate is this process's rate_share of the configured one.
+    '''
+    global transport, transport_pid
+    if transport is None or transport_pid != os.getpid():
+        settings = get_settings("api", api_defaults)
+        for key in ("rate_limit", "rate_limit_min", "rate_limit_max"):
+            settings[key] *= rate_share
+        settings["rate_limit_burst"] = max(1, int(settings["rate_limit_burst"] * rate_share))
+        if record_directory is not None:
+            transport = RecordingTransport(record_directory, **settings)
+        else:
+            transport = Transport(**settings)
+        transport_pid = os.getpid()
+    return transport
+
+
+def start_recording(directory):
+    ''' Record every response fetched from now on into directory.  The caches
+    are turned off so that every response is actually fetched and recorded.
+    '''
+    global record_directory, transport
+    global response_cache, response_cache_loaded, logo_cache, logo_cache_loaded
+    global peer_store
+    record_directory = directory
+    transport = None
+    response_cache, response_cache_loaded = None, True
+    logo_cache, logo_cache_loaded = None, True
+    peer_store = None
+
+
+def worker_settings(workers=1):
+    ''' What each of a pool of `workers` processes needs to reach the API
+    the way this process does: the endpoint, the directory responses are
+    recorded into, whether reads come from the snapshot, and its share of
+    the request rate.  A worker started by spawn rather than fork imports
+    this module afresh, so these are handed to it explicitly and applied
+    with apply_worker_settings.
+    '''
+    return {
+        "endpoint": endpoint,
+        "record_directory": record_directory,
+        "offline": snapshot_store is not None,
+        "rate_share": rate_share / workers,
+    }
+
+
+def apply_worker_settings(settings):
+    ''' Set up this worker process from worker_settings() of its parent
+    '''
+    global endpoint, rate_share, transport
+    endpoint = settings["endpoint"]
+    if rate_share != settings["rate_share"]:
+        rate_share = settings["rate_share"]
+        transport = None
+    if settings["record_directory"] is not None and record_directory != settings["record_directory"]:
+        start_recording(settings["record_directory"])
+    if settings["offline"] and snapshot_store is None:
+        start_offline()
+
+
+class TokenManager(object):
+    ''' Holds the Databook bearer token.  The token and its expiry are persisted
+    so later runs and batch workers reuse it instead of logging in, it is
+    renewed shortly before it expires, and only one refresh is in flight at a
+    time no matter how many requests are rejected at once.
+    '''
+    def __init__(self, token_file, refresh_margin=300, token_lifetime=3600):
+        self.token_file = token_file
+        self.refresh_margin = refresh_margin
+        self.token_lifetime = token_lifetime
+        self.token = None
+        self.expires_at = 0
+        self.lock = threading.Lock()
+
+    def headers(self):
+        ''' Authorization header for a request, refreshing the token first if
+        it is missing or about to expire
+        '''
+        token = self.token
+        if token is None or self.expiring():
+            token = self.refresh(stale_token=token)
+        return {"Authorization": f"Bearer {token}"}
+
+    def expiring(self):
+        return time.time() >= self.expires_at - self.refresh_margin
+
+    def refresh(self, stale_token=None):
+        ''' Get a usable token, logging in only if the best known token is
+        stale_token or is expiring.  Callers that raced on the same rejected
+        token wait for the first refresh and then share its result.
+        '''
+        with tracing.span("token refresh", "auth"), self.lock:
+            if self.token != stale_token and not self.expiring():
+                return self.token
+            with self.file_lock():
+                self.load()
+                if self.token is None or self.token == stale_token or self.expiring():
+                    tracing.annotate(logged_in=True)
+                    self.token = login()
+                    self.expires_at = token_expiry(self.token, self.token_lifetime)
+                    self.save()
+            return self.token
+
+    def load(self):
+        ''' Read a token persisted by an earlier run or another worker
+        '''
+        try:
+            with open(self.token_file) as f:
+                saved = json.load(f)
+            token, expires_at = saved["token"], saved["expires_at"]
+        except (OSError, ValueError, KeyError):
+            return
+        if expires_at > self.expires_at:
+            self.token, self.expires_at = token, expires_at
+
+    def save(self):
+        ''' Persist the token atomically, readable only by the current user
+        '''
+        directory = os.path.dirname(self.token_file)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"token": self.token, "expires_at": self.expires_at}, f)
+        os.chmod(tmp, 0o600)
+        os.replace(tmp, self.token_file)
+
+    def file_lock(self):
+        ''' Lock shared with other processes so only one of them logs in
+        '''
+        return FileLock(f"{self.token_file}.lock")
+
+
+class FileLock(object):
+    ''' Exclusive advisory lock on a file, held for the duration of a with
+    block.  With remove, the file is deleted when the lock is released, so
+    locks taken per URL do not pile up; a process that was waiting on the
+    deleted file then locks a new one.
+    '''
+    def __init__(self, path, remove=False):
+        self.path = path
+        self.remove = remove
+        self.handle = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            while True:
+                self.handle = open(self.path, "a")
+                fcntl.flock(self.handle, fcntl.LOCK_EX)
+                if not self.remove or self.is_current():
+                    break
+                self.handle.close()
+        return self
+
+    def is_current(self):
+        ''' Whether the locked file is still the one at path
+        '''
+        try:
+            return os.stat(self.path).st_ino == os.fstat(self.handle.fileno()).st_ino
+        except OSError:
+            return False
+
+    def __exit__(self, *exc):
+        if self.handle is not None:
+            if self.remove:
+                try:
+                    os.remove(self.path)
+                except OSError:
+                    pass
+            fcntl.flock(self.handle, fcntl.LOCK_UN)
+            self.handle.close()
+            self.handle = None
+
+
+def token_expiry(token, default_lifetime):
+    ''' Expiry time of a JWT from its exp claim, or default_lifetime from now
+    if the token cannot be decoded
+    '''
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (IndexError, ValueError, KeyError, TypeError):
+        return time.time() + default_lifetime
+
+
+def get_token_manager():
+    ''' Returns the shared TokenManager, creating it from config.ini on first use
+    '''
+    global token_manager
+    if token_manager is None:
+        token_manager = TokenManager(**get_settings("auth", auth_defaults))
+    return token_manager
+
+
+def get_cache():
+    ''' Returns the shared ResponseCache, or None if caching is disabled
+    '''
+    global response_cache, response_cache_loaded
+    if not response_cache_loaded:
+        settings = get_settings("cache", cache_defaults)
+        if settings["enabled"]:
+            response_cache = cache.ResponseCache(
+                os.path.join(settings["directory"], "responses"),
+                [
+                    (r"/api/companies/?$", settings["companies_ttl"]),
+                    (r"/api/companies/[^/]+/metrics/[^/]+$", settings["metric_details_ttl"]),
+                    (r"/api/companies/[^/]+/metrics$", settings["metrics_ttl"]),
+                    (r"/api/companies/[^/]+$", settings["overview_ttl"]),
+                ],
+                int(settings["max_mb"] * 1024 * 1024)
+            )
+        response_cache_loaded = True
+    return response_cache
+
+
+def get_logo_cache():
+    ''' Returns the shared LogoCache, or None if caching is disabled
+    '''
+    global logo_cache, logo_cache_loaded
+    if not logo_cache_loaded:
+        settings = get_settings("cache", cache_defaults)
+        if settings["enabled"]:
+            logo_cache = cache.LogoCache(
+                os.path.join(settings["directory"], "logos"),
+                settings["logo_ttl"],
+                int(settings["logo_max_mb"] * 1024 * 1024)
+            )
+        logo_cache_loaded = True
+    return logo_cache
+
+
+def start_peer_sharing():
+    ''' Answer metric details from responses fetched for peers, as batch runs
+    over a sector do.  Stays off while caching is disabled, responses are
+    being recorded or decks are rendered offline.
+    '''
+    global peer_store
+    settings = get_settings("cache", cache_defaults)
+    if settings["enabled"] and record_directory is None and snapshot_store is None:
+        peer_store = cache.PeerStore(
+            os.path.join(settings["directory"], "peers"),
+            settings["metric_details_ttl"],
+            settings["peer_group_ttl"],
+            int(settings["peer_max_mb"] * 1024 * 1024)
+        )
+    return peer_store
+
+
+def get_snapshot_store():
+    ''' Opens the SnapshotStore named in config.ini, creating it if needed
+    '''
+    return snapshot.SnapshotStore(get_settings("snapshot", snapshot_defaults)["path"])
+
+
+def start_offline():
+    ''' Answer every read from the snapshot instead of the API.  Nothing is
+    fetched, so nothing needs a token and data missing from the snapshot
+    raises a DatabookError.
+    '''
+    global snapshot_store, peer_store
+    snapshot_store = get_snapshot_store()
+    peer_store = None
+    return snapshot_store
+
+
+def from_snapshot(value, what):
+    if value is None:
+        raise DatabookError(
+            f"No {what} in the snapshot at {snapshot_store.path}; run deckbot.py sync first"
+        )
+    return value
+
+
+def sync_company(store, company_id, metric_names, full=False):
+    ''' Copy one company's overview, metric list and logo, and the details of
+    the metrics in metric_names, from the API into a SnapshotStore.
+
+    The overview is always polled, revalidating any cached copy.  The rest
+    is only fetched if the company is new to the snapshot, has reported a
+    quarter since it was last synced, or full is set, and those GETs are
+    revalidated too, since a cached copy may predate the report.  Details
+    are always the company's own, since a peer's chart may be drawn for a
+    different peer group.  The overview is saved last, so a company listed in the
+    snapshot has everything else saved too.
+
+    Returns (company name, whether it is new or has reported).
+    '''
+    path = f"{endpoint}/api/companies/{company_id}"
+    overview = json.loads(get_api(path, revalidate=True).content)
+    overview["_id"] = company_id
+    previous = store.overview(company_id)
+    reported = previous is None or snapshot.reporting_key(previous) != snapshot.reporting_key(overview)
+    if reported or full:
+        metrics = json.loads(get_api(f"{path}/metrics", revalidate=True).content)
+        for metric in metrics:
+            name = metric.get("name")
+            if name in metric_names:
+                details = get_api(f"{path}/metrics/{metric['_id']}", revalidate=True)
+                store.save_details(company_id, name, json.loads(details.content))
+        if overview.get("logoUrl"):
+            try:
+                store.save_logo(overview["logoUrl"], get_image(overview["logoUrl"]))
+            except DatabookError:
+                pass
+        store.save_metrics(company_id, metrics)
+    store.save_overview(overview)
+    return overview.get("name"), reported
+
+
+def get_api(path, revalidate=False):
+    ''' Performs a GET from the Databook API, answering from the response cache
+    when a fresh copy is stored and revalidating stale copies.  With
+    revalidate, even a fresh copy is checked with a conditional GET.
+    Identical GETs in flight at the same time share one request: threads of
+    a process via SingleFlight, and processes via a lock on the URL's cache
+    entry.  If token is expired, it will renew once and try again.  Any other
+    failure raises a DatabookError.
+    '''
+    with tracing.span("GET", "api", url=url_template(path)):
+        return in_flight.do((path, revalidate), fetch_api, path, revalidate)
+
+
+def fetch_api(path, revalidate=False):
+    response_cache = get_cache()
+    if response_cache is None or not response_cache.ttl_for(path):
+        return fetch_fresh(path, None, None)
+
+    entry = response_cache.lookup(path)
+    if entry is None or revalidate or not response_cache.is_fresh(entry):
+        # Another process may be fetching this URL; wait for it and take its
+        # response from the cache.
+        asked = time.time()
+        with FileLock(response_cache.lock_path(path), remove=True):
+            entry = response_cache.lookup(path)
+            if (entry is None or not response_cache.is_fresh(entry)
+                    or (revalidate and entry["stored_at"] < asked)):
+                response_cache.count("misses")
+                tracing.annotate(cache="miss")
+                return fetch_fresh(path, response_cache, entry)
+            tracing.annotate(coalesced=True)
+    response_cache.count("hits")
+    response = cached_response(response_cache, entry)
+    tracing.annotate(cache="hit", status=200, bytes=len(response.content))
+    return response
+
+
+def fetch_fresh(path, response_cache, entry):
+    ''' GET path from the API, revalidating entry if there is one, and store
+    the response in response_cache
+    '''
+    conditional = response_cache.validators(entry) if entry is not None else {}
+    response = get_authorized(path, headers=conditional)
+    tracing.annotate(status=response.status_code, bytes=len(response.content))
+    if response.status_code == 304 and entry is not None:
+        tracing.annotate(cache="revalidated")
+        return cached_response(response_cache, response_cache.refresh(entry))
+    check_response(response)
+    if response_cache is not None:
+        response_cache.store(path, response)
+    return response
+
+
+def get_authorized(path, headers=None, **kwargs):
+    ''' GET with the security token.  If the token has expired, it is renewed
+    once and the request sent again.
+    '''
+    tokens = get_token_manager()
+    token_headers = tokens.headers()
+    response = get_transport().get(path, headers={**token_headers, **(headers or {})}, **kwargs)
+    if response.status_code == 401:
+        # Refresh security token and get API again.  Concurrent requests
+        # rejected with the same token share a single refresh.
+        tracing.annotate(reauthenticated=True)
+        response.close()
+        stale_token = token_headers["Authorization"][len("Bearer "):]
+        token_headers = {"Authorization": f"Bearer {tokens.refresh(stale_token)}"}
+        response = get_transport().get(path, headers={**token_headers, **(headers or {})}, **kwargs)
+    return response
+
+
+def url_template(url):
+    ''' The API path of a URL with ids replaced by placeholders, so timings
+    can be grouped by endpoint
+    '''
+    path = url[len(endpoint):] if url.startswith(endpoint) else url
+    path = re.sub(r"/metrics/[^/?]+", "/metrics/{metric_id}", path)
+    return re.sub(r"/companies/[^/?]+", "/companies/{id}", path)
+
+
+def cached_response(response_cache, entry):
+    return CachedResponse(
+        entry["url"], response_cache.content(entry), entry.get("content_type")
+    )
+
+
+def get_image(url):
+    ''' Returns the bytes of an image, such as a company logo.  Images are
+    served from the logo cache while fresh and revalidated once stale.
+    Offline, they come from the snapshot.
+    '''
+    if snapshot_store is not None:
+        return from_snapshot(snapshot_store.logo(url), f"logo {url}")
+    with tracing.span("logo GET", "api", url=url):
+        logo_cache = get_logo_cache()
+        entry = blob = None
+        if logo_cache is not None:
+            entry, blob = logo_cache.lookup(url)
+            if blob is not None and logo_cache.is_fresh(entry):
+                logo_cache.count("hits")
+                tracing.annotate(cache="hit", bytes=len(blob))
+                return blob
+            logo_cache.count("misses")
+            tracing.annotate(cache="miss")
+
+        conditional = logo_cache.validators(entry) if blob is not None else {}
+        response = get_transport().get(url, headers=conditional)
+        tracing.annotate(status=response.status_code, bytes=len(response.content))
+        if response.status_code == 304 and blob is not None:
+            tracing.annotate(cache="revalidated")
+            logo_cache.refresh(entry)
+            return blob
+        if response.status_code != 200:
+            raise DatabookHTTPError(response.status_code, url)
+        if logo_cache is not None:
+            logo_cache.store(url, response)
+        return response.content
+
+
+def check_response(response):
+    ''' Raises the matching DatabookError for any response that is not a 200
+    '''
+    if response.status_code == 200:
+        return
     elif response.status_code == 401:
-        # Refresh security token and get API again.
-        headers = get_token()
-        response = get_api(path)
-        return response
+        raise DatabookAuthError(f"The API rejected a fresh token for {response.url}")
     elif response.status_code == 500:
-    	# Error
-    	print(f"The server did not accept the company_id")
-    	exit()
+        raise DatabookHTTPError(
+            500,
+            response.url,
+            f"The server did not accept the company_id ({response.url})"
+        )
     else:
-        # Need to Add Error Handling for other issues
-        print(f"Something went wrong.  Code: {response}")
-        exit()
-        
+        raise DatabookHTTPError(response.status_code, response.url)
+
 
 def get_token():
-    ''' Get a security token from the Databook API
+    ''' Get the Authorization header for the Databook API, reusing the persisted
+    token while it is valid.  Offline, no token is needed.
+    '''
+    if snapshot_store is not None:
+        return {}
+    return get_token_manager().headers()
+
+
+def login():
+    ''' Get a new security token from the Databook API
     '''
-    global headers
     email, pwd = get_login()
     path = '/auth/local'
     body = {"email": email, "password": pwd}
-    response = requests.post(f"{endpoint}{path}", data=body)
+    response = get_transport().post(f"{endpoint}{path}", data=body)
+    if response.status_code != 200:
+        raise DatabookAuthError(
+            f"Login failed with code {response.status_code}.  Check config.ini."
+        )
     content = json.loads(response.content)
-    token = content["token"]
-    headers = {"Authorization": f"Bearer {token}"}
-    return headers
+    return content["token"]
 
 def get_login():
 	''' Get login info from config.ini
@@ -117,6 +1297,20 @@ def get_login():
 	email = config.get("login", "email")
 	password = config.get("login", "password")
 	return (email, password)
+
+def get_settings(section, defaults):
+    ''' Get optional settings from a section of config.ini.  Missing values fall
+    back to defaults and are cast to the default's type.
+    '''
+    config = configparser.ConfigParser()
+    config.read("config.ini")
+    settings = {}
+    for key, default in defaults.items():
+        if isinstance(default, bool):
+            settings[key] = config.getboolean(section, key, fallback=default)
+        else:
+            settings[key] = type(default)(config.get(section, key, fallback=default))
+    return settings
     
 
 
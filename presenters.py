@@ -4,7 +4,9 @@
 # Author:    Drew Fulton
 # Created:    April 2020
 
-import models, urllib.request, os, calendar, datetime, re, operator, statistics
+import models, tracing, io, os, sys, json, hashlib, calendar, datetime, re, time, copy, threading, tempfile, functools, zipfile, collections, weakref
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+import numpy as np
 from pptx import Presentation
 from pptx.util import Inches, Pt
 from pptx.enum.chart import XL_CHART_TYPE, XL_LABEL_POSITION, XL_LEGEND_POSITION
@@ -12,57 +14,213 @@ from pptx.enum.shapes import MSO_SHAPE
 from pptx.enum.text import MSO_AUTO_SIZE, MSO_ANCHOR, PP_ALIGN
 from pptx.dml.color import RGBColor
 from pptx.chart.data import CategoryChartData
+from pptx.chart.xlsx import CategoryWorkbookWriter
+from pptx.parts.image import Image, ImagePart
+from pptx.parts.chart import ChartPart
+from pptx.parts.embeddedpackage import EmbeddedXlsxPart
+from pptx.opc.constants import RELATIONSHIP_TYPE as RT, CONTENT_TYPE as CT
+from pptx.opc.packuri import PackURI
+from pptx.opc.package import Part
+from xml.sax.saxutils import escape as xml_escape
 
 class DeckbotPresenter(object):
 	''' The main application logic.
 	'''
+	# Metrics whose details the slides chart.  These are fetched up front along
+	# with the rest of the company data.
+	required_metrics = ("Revenue",)
+	# Where decks are saved when no target is given.  {id} and {name} are
+	# filled in from the company; relative paths are under the app directory.
+	default_output = "exports/{name}-{id}.pptx"
+	# Bump whenever the slide builders change what they draw, so decks made
+	# by an older version are rebuilt even though their data has not moved.
+	template_version = 3
+	# Embed chart workbooks written by QuickWorkbookWriter instead of
+	# xlsxwriter, and add charts with add_quick_chart.  The charts look the
+	# same; False goes back to python-pptx's own add_chart.
+	quick_charts = True
 
-	def __init__(self, view=None, company_id=None):
-		models.get_token()
+	def __init__(self, view=None, force=False):
+		''' With force, decks are rebuilt even when their inputs are unchanged
+		'''
 		self.view = view
+		self.force = force
 		self.dir = os.path.dirname(os.path.abspath(__file__))
+		# Decks left alone because nothing they show has changed
+		self.unchanged = 0
+
+	def run(self, company_id=None, target=None):
+		''' Create a deck for one company.  If no company_id is given, the user
+		is prompted to select one.  See create_deckbot for target.
+		'''
 		if company_id is not None:
 			company=models.Company(company_id)
 		else:
-			self.all_companies = models.get_all_companies(offline=True)
 			company = self.init_view()
-		self.get_company_details(company)
-		self.create_deckbot(company)
+		unchanged = self.unchanged
+		path = self.make_deck(company, target)
+		if path is not None and self.unchanged > unchanged:
+			print(f"Nothing has changed since your file at {path} was made")
+		elif path is not None:
+			print(f"Please find your file at {path}")
+
+	def make_deck(self, company, target=None):
+		''' Fetch everything the slides need for the company, render the deck and
+		write it to target.  Returns the path written, if any.
+		'''
+		with tracing.span("deck", "deck", company_id=company.id):
+			self.get_company_details(company)
+			return self.create_deckbot(company, target)
 
 	def init_view(self):
-		''' Upon initial start, get the list of available companies, and prompt user.
+		''' Upon initial start, open the local company index, and prompt user.
+		The index is only downloaded in full the first time.
 		'''
-		company = self.view.select_company(self.all_companies)
-		return company
+		entry = self.view.select_company(models.get_company_index())
+		return models.Company(entry["id"], entry["name"])
 
 	def get_company_details(self, company):
-		''' Get all the information and metrics for the company.
+		''' Get all the information and metrics for the company before rendering.
+		The overview and metric list are requested together, and the logo and
+		metric details are started as soon as the response they depend on
+		arrives, so a deck waits on the slowest chain rather than every call.
 		'''
-		company.get_company_overview()
-		company.metrics = company.get_company_metrics()
+		with tracing.span("fetch", "fetch", company_id=company.id), \
+			ThreadPoolExecutor(max_workers=4) as pool:
+			overview = pool.submit(company.get_company_overview)
+			metrics = pool.submit(getattr, company, "metrics")
+
+			overview.result()
+			logo = pool.submit(self.fetch_logo, company)
+
+			metrics = metrics.result()
+			details = [
+				pool.submit(metrics[name].get_metric_details)
+				for name in self.required_metrics
+				if name in metrics
+			]
+
+			for d in details:
+				d.result()
+			company.logo_image = logo.result()
 		return company
 
-	def create_deckbot(self, company):
-		''' Genererate Powerpoint FactPack with 3 main slides.
+	def fetch_logo(self, company):
+		''' Download the company logo.  Returns the image bytes, or None if the
+		logo cannot be retrieved.
 		'''
-		ppt = Presentation()
+		logo_url = getattr(company, "logoUrl", None)
+		if not logo_url:
+			return None
+		try:
+			return models.get_image(logo_url)
+		except models.DatabookError:
+			print("Error retrieving logo from website and will be skipped.", file=sys.stderr)
+			return None
 
-		ppt = self.build_title_slide(ppt, company)
-		ppt = self.build_overview_slide(ppt, company)
-		ppt = self.build_revenue_slide(ppt, company)   
-	
-		if not os.path.exists(f"{self.dir}/exports"):
-			os.mkdir(f"{self.dir}/exports") 
-				 
-		ppt.save(f"{self.dir}/exports/{company.name}.pptx")
-	
-		print(f"Please find your file at /exports/{company.name}.pptx")
+	def create_deckbot(self, company, target=None):
+		''' Genererate Powerpoint FactPack and write it to target, which may be a
+		writable binary stream, "-" for stdout, or a path template using {id}
+		and {name}.  Returns the path written, or None for streams.
+
+		A deck written to a path is skipped when the fingerprints saved with it
+		match the company's current inputs; the existing path is returned.
+		'''
+		target = target or self.default_output
+		if hasattr(target, "write") or target == "-":
+			return write_deck(self.render_deck(company), target, company, self.dir)
+
+		path = deck_path(target, company, self.dir)
+		fingerprints = self.fingerprints(company)
+		saved = load_fingerprints(path)
+		changed = [slide for slide in fingerprints if saved.get(slide) != fingerprints[slide]]
+		tracing.annotate(changed=changed)
+		if not changed and not self.force and os.path.exists(path):
+			self.unchanged += 1
+			return path
+
+		write_file(path, self.render_deck(company))
+		write_file(fingerprints_path(path), json.dumps(fingerprints, indent=2).encode("utf-8"))
+		return path
+
+	def fingerprints(self, company):
+		''' A digest of everything each slide shows, keyed by slide.  The
+		template version and cover image go into every one of them.
+		'''
+		template = (self.template_version, get_deck_template(self.dir).cover.sha1)
+		return {
+			"title": fingerprint(template, *self.title_slide_inputs(company)),
+			"overview": fingerprint(template, *self.overview_slide_inputs(company)),
+			"revenue": fingerprint(template, *self.revenue_slide_inputs(company)),
+		}
+
+	def title_slide_inputs(self, company):
+		''' What build_title_slide draws from.  The creation date is left out,
+		so an unchanged deck keeps the date it was made.
+		'''
+		latest = company.latestRevenue
+		return [
+			company.name,
+			latest and (latest.quarter, latest.year),
+			company.logo_image
+		]
+
+	def overview_slide_inputs(self, company):
+		''' What build_overview_slide draws from
+		'''
+		latest = company.latestRevenue
+		return [
+			company.name,
+			latest and latest.value_usd,
+			[getattr(company, field) for field in company.overview_fields]
+		]
+
+	def revenue_slide_inputs(self, company):
+		''' What build_revenue_slide draws from, the peer matrices included
+		'''
+		revenue = company.metrics["Revenue"]
+		growth = company.latestRevenueGrowth
+		inputs = [
+			company.name,
+			revenue.name,
+			revenue.description,
+			growth and (growth.quarter, growth.year)
+		]
+		for chart in revenue.chart:
+			inputs.append((chart.names, chart.labels, chart.periods, [sorted(g) for g in chart.groups]))
+			inputs.append(chart.values)
+		return inputs
+
+	def render_deck(self, company):
+		''' Genererate Powerpoint FactPack with 3 main slides in memory and return
+		the .pptx bytes.
+		'''
+		with tracing.span("template copy", "render"):
+			ppt, cover = get_deck_template(self.dir).new_deck()
+
+		with tracing.span("build_title_slide", "render"):
+			ppt = self.build_title_slide(ppt, company, cover=cover)
+		with tracing.span("build_overview_slide", "render"):
+			ppt = self.build_overview_slide(ppt, company)
+		with tracing.span("build_revenue_slide", "render"):
+			ppt = self.build_revenue_slide(ppt, company)   
 	
+		with tracing.span("ppt.save", "render"):
+			buffer = io.BytesIO()
+			ppt.save(buffer)
+			tracing.annotate(bytes=buffer.tell())
+		return buffer.getvalue()
 	
-	def build_title_slide(self, ppt, company):
+	def build_title_slide(self, ppt, company, cover=None, media=None):
 		''' Builds the title slide using existing title/subtitle placeholders.
-		Adds the company logo and photo to the slide.
+		Adds the company logo and photo to the slide.  cover is the template's
+		already ingested cover image part; without it the image is read from
+		assets/.  With a MediaParts, a logo already in the deck is reused.
 		'''
+		if cover is not None and media is None:
+			# The cover is not related to anything yet, so add_picture would
+			# give the logo the cover's part name.
+			media = MediaParts(ppt.part.package, [cover])
 		# Title Slide - Title Slide Layout
 		title_slide_layout = ppt.slide_layouts[0]
 		title_slide = ppt.slides.add_slide(title_slide_layout)
@@ -70,23 +228,27 @@ class DeckbotPresenter(object):
 		subtitle = title_slide.placeholders[1]
 		today = datetime.date.today().strftime("%B %d, %Y")
 	
-		logofile, extension = os.path.splitext(company.logoUrl)
-		try:
-			urllib.request.urlretrieve(
-				company.logoUrl, 
-				f"{self.dir}/assets/{company.name}{extension}"
-			)
-			logo = title_slide.shapes.add_picture(
-				f"{self.dir}/assets/{company.name}{extension}", 
-				Inches(.5), 
-				Inches(.5), 
-				height=Inches(1.5)
-			)
-			os.remove(f"{self.dir}/assets/{company.name}{extension}")
-		except:
-			print("Error retrieving logo from website and will be skipped.")
+		if company.logo_image is not None:
+			try:
+				if media is not None:
+					logo = add_image_part(
+						title_slide, 
+						media.image_part(company.logo_image), 
+						Inches(.5), 
+						Inches(.5), 
+						height=Inches(1.5)
+					)
+				else:
+					logo = title_slide.shapes.add_picture(
+						io.BytesIO(company.logo_image), 
+						Inches(.5), 
+						Inches(.5), 
+						height=Inches(1.5)
+					)
+			except Exception:
+				print("Logo is not a supported image and will be skipped.", file=sys.stderr)
 	
-		latestRev = f"Data through Q{company.latestRevenue['quarter']} {company.latestRevenue['year']}"
+		latestRev = f"Data through Q{company.latestRevenue.quarter} {company.latestRevenue.year}"
 		title.text = f"{company.name} - Factpack"
 		subtitle_frame = subtitle.text_frame
 		subtitle_frame.clear()
@@ -96,12 +258,21 @@ class DeckbotPresenter(object):
 		p2 = subtitle_frame.add_paragraph()
 		p2.text = latestRev
 	
-		img = title_slide.shapes.add_picture(
-			f"{self.dir}/assets/cover.jpg", 
-			Inches(0), 
-			Inches(5.5), 
-			height=Inches(2)
-		)
+		if cover is not None:
+			img = add_image_part(
+				title_slide, 
+				cover, 
+				Inches(0), 
+				Inches(5.5), 
+				height=Inches(2)
+			)
+		else:
+			img = title_slide.shapes.add_picture(
+				f"{self.dir}/assets/cover.jpg", 
+				Inches(0), 
+				Inches(5.5), 
+				height=Inches(2)
+			)
 	
 		return ppt
 
@@ -187,7 +358,7 @@ class DeckbotPresenter(object):
 		facts_text = []
 		facts_text.append((
 			("Revenue: ", {"bold":True}), 
-			(f"US$ {company.latestRevenue['valueUSD']} bn", {"bold":False})
+			(f"US$ {company.latestRevenue.value_usd} bn", {"bold":False})
 		))
 		facts_text.append((
 			("Employees: ", {"bold":True}), 
@@ -243,13 +414,7 @@ class DeckbotPresenter(object):
 		metrics_slide = ppt.slides.add_slide(metrics_slide_layout)
 		shapes = metrics_slide.shapes
 	
-		# Get Metric Details
-		for m in company.metrics:
-			if m.name == "Revenue":
-				revenue = m
-				break
-	
-		revenue.get_metric_details()
+		revenue = company.metrics["Revenue"]
 	
 		# Title Box
 		title_sizes = {}
@@ -285,35 +450,24 @@ class DeckbotPresenter(object):
 	
 	
 		# Latests Revenue vs Peers Section
-		latest_rev_v_peers_chart_data = CategoryChartData()
+		latest_rev_v_peers_chart_data = self.new_chart_data()
 		latest_rev_v_peers_chart_data.categories = ['Latest Values']
-		data = {}
-		categories = []
-		values = []
-		i=1
-		for c in revenue.chart[0]["companies"]:
-			data[c["name"]] = c["data"][0]["value"]
-			if i==1:
-				period_label = c["data"][0]["label"]
-				period = c["data"][0]["period"]
-			i=+1
-		sorted_data = sorted(data.items(), key=operator.itemgetter(1))    
-		for d in sorted_data:
-			categories.append(d[0])
-			values.append(d[1])
-			if d[0] == company.name:
-				company_position = sorted_data.index(d)+1
+		peers = revenue.chart[0]
+		categories, values = peers.column(0)
+		period_label = peers.labels[0]
+		period = peers.periods[0]
 		
 		latest_rev_v_peers_chart_data.categories = categories
 		latest_rev_v_peers_chart_data.add_series(
 			"Latest Values", 
-			values, 
+			values.tolist(), 
 			number_format="#,###.#"
 		)
 		x, y, cx, cy = Inches(5.25), Inches(2.5), Inches(4.5), Inches(4)
-		graphic_frame = metrics_slide.shapes.add_chart(    
-			XL_CHART_TYPE.BAR_CLUSTERED, x, y, cx, cy, latest_rev_v_peers_chart_data
-		)
+		with tracing.span("add_chart", "render", chart="latest vs peers"):
+			graphic_frame = self.add_chart(
+				metrics_slide, XL_CHART_TYPE.BAR_CLUSTERED, x, y, cx, cy, latest_rev_v_peers_chart_data
+			)
 		chart = graphic_frame.chart    
 		plot = chart.plots[0]
 		plot.has_data_labels = True
@@ -363,49 +517,33 @@ class DeckbotPresenter(object):
 		period_label_plain = {}
 		period_label_plain["ltm"] = "last twelve months"
 		period_label_plain["y"] = "year"
-		company_count = len(sorted_data)
-		quartile = get_quartile(company_position/company_count)
-		latest_rev_anal_text = f"{company.name} Revenue is in the {quartile} quartile of the peer group over the {period_label_plain[period]}."
-		latest_rev_anal_sizes = {}
-		latest_rev_anal_sizes["left"] = Inches(5.25)
-		latest_rev_anal_sizes["top"] = Inches(6.5)
-		latest_rev_anal_sizes["width"] = Inches(4.5)
-		latest_rev_anal_sizes["height"] = Inches (.5)
-		shapes = self.create_textbox(
-			shapes, 
-			latest_rev_anal_sizes, 
-			latest_rev_anal_text, 
-			alignment=PP_ALIGN.LEFT, 
-			color=RGBColor(0,0,0), 
-			size=Pt(14)
-		)
+		# Left out when the company has no value to place among its peers
+		quartile = peers.quartile(company.name, 0)
+		if quartile is not None:
+			latest_rev_anal_text = f"{company.name} Revenue is in the {get_quartile(quartile)} quartile of the peer group over the {period_label_plain[period]}."
+			latest_rev_anal_sizes = {}
+			latest_rev_anal_sizes["left"] = Inches(5.25)
+			latest_rev_anal_sizes["top"] = Inches(6.5)
+			latest_rev_anal_sizes["width"] = Inches(4.5)
+			latest_rev_anal_sizes["height"] = Inches (.5)
+			shapes = self.create_textbox(
+				shapes, 
+				latest_rev_anal_sizes, 
+				latest_rev_anal_text, 
+				alignment=PP_ALIGN.LEFT, 
+				color=RGBColor(0,0,0), 
+				size=Pt(14)
+			)
 
 
 		# Revenue for Last 3 Years Section
-		last_three_chart_data = CategoryChartData()
-		last_three_data = {}
-		for c in revenue.chart[0]["companies"]:
-			last_three_data[c["name"]] = {}
-			for p in c["data"]:
-				if "Last 3 years" in p["groups"]:
-					last_three_data[c["name"]][p["label"]] = p["value"]
-			
-		cats = list(last_three_data[company.name].keys())
-		cats.reverse()
+		last_three_chart_data = self.new_chart_data()
+		columns = peers.group_columns("Last 3 years")
+		columns.reverse()
+		cats = [peers.labels[i] for i in columns]
 		last_three_chart_data.categories = cats
-		company_data = []
-		median_data = {}
-		medians = {}
-		for cat in cats:
-			company_data.append(last_three_data[company.name][cat])
-			median_data[cat] = [] 
-			for comp in last_three_data:
-				median_data[cat].append(last_three_data[comp][cat])
-			medians[cat] = statistics.median(median_data[cat])
-	
-		med = []
-		for m in medians:
-			med.append(medians[m])
+		company_data = chart_values(peers.row(company.name)[columns])
+		med = chart_values(peers.medians(columns))
 		last_three_chart_data.add_series(
 			company.name, 
 			company_data, 
@@ -413,9 +551,10 @@ class DeckbotPresenter(object):
 		)
 		last_three_chart_data.add_series("Medians", med, number_format="#,###.#")
 		x, y, cx, cy = Inches(.5), Inches(2.5), Inches(4.5), Inches(4)
-		last_three_frame = metrics_slide.shapes.add_chart( 
-			XL_CHART_TYPE.COLUMN_CLUSTERED, x, y, cx, cy, last_three_chart_data
-		)
+		with tracing.span("add_chart", "render", chart="last three years"):
+			last_three_frame = self.add_chart(
+				metrics_slide, XL_CHART_TYPE.COLUMN_CLUSTERED, x, y, cx, cy, last_three_chart_data
+			)
 	
 		chart = last_three_frame.chart    
 		plot = chart.plots[0]
@@ -475,33 +614,45 @@ class DeckbotPresenter(object):
 		period_label_plain["ltm"] = "last twelve months"
 		period_label_plain["y"] = "year"
 	
-		if company_data[-1] > company_data[0]:
-			direction = "grew"
-		elif company_data[0] == company_data[-1]:
-			direction = "held steady"
-		else:
-			direction = "fell"
-
-		company_count = len(sorted_data)
-		quartile = get_quartile(company_position/company_count)
+		# Left out when either end of the range is missing
+		growth = peers.growth(columns[0], columns[-1])[peers.rows[company.name]]
+		if not np.isnan(growth):
+			if growth > 0:
+				direction = "grew"
+			elif growth == 0:
+				direction = "held steady"
+			else:
+				direction = "fell"
 	
-		last_three_rev_anal_text = f"{company.name} Revenue {direction} from USD{company_data[0]}B in FY{cats[0]} to USD{company_data[-1]}B at the end of Q{company.latestRevenueGrowth['quarter']} FY{company.latestRevenueGrowth['year']}."
-		last_three_rev_anal_sizes = {}
-		last_three_rev_anal_sizes["left"] = Inches(.5)
-		last_three_rev_anal_sizes["top"] = Inches(6.5)
-		last_three_rev_anal_sizes["width"] = Inches(4.5)
-		last_three_rev_anal_sizes["height"] = Inches (.5)
-		shapes = self.create_textbox(
-			shapes, 
-			last_three_rev_anal_sizes, 
-			last_three_rev_anal_text, 
-			alignment=PP_ALIGN.LEFT, 
-			color=RGBColor(0,0,0), 
-			size=Pt(14)
-		)
+			last_three_rev_anal_text = f"{company.name} Revenue {direction} from USD{company_data[0]}B in FY{cats[0]} to USD{company_data[-1]}B at the end of Q{company.latestRevenueGrowth.quarter} FY{company.latestRevenueGrowth.year}."
+			last_three_rev_anal_sizes = {}
+			last_three_rev_anal_sizes["left"] = Inches(.5)
+			last_three_rev_anal_sizes["top"] = Inches(6.5)
+			last_three_rev_anal_sizes["width"] = Inches(4.5)
+			last_three_rev_anal_sizes["height"] = Inches (.5)
+			shapes = self.create_textbox(
+				shapes, 
+				last_three_rev_anal_sizes, 
+				last_three_rev_anal_text, 
+				alignment=PP_ALIGN.LEFT, 
+				color=RGBColor(0,0,0), 
+				size=Pt(14)
+			)
 
 		return ppt
 
+	def new_chart_data(self):
+		''' Empty data for a category chart, see quick_charts
+		'''
+		return QuickChartData() if self.quick_charts else CategoryChartData()
+
+	def add_chart(self, slide, chart_type, x, y, cx, cy, chart_data):
+		''' Adds a chart to the slide and returns its graphic frame
+		'''
+		if self.quick_charts:
+			return add_quick_chart(slide, chart_type, x, y, cx, cy, chart_data)
+		return slide.shapes.add_chart(chart_type, x, y, cx, cy, chart_data)
+
 	def set_shape_colors(
 		self, 
 		shape, 
@@ -587,49 +738,796 @@ class DeckbotPresenter(object):
 	
 		return shapes
 
-def get_quartile(percentage):
-	''' Calculate quartile given a percentage. '''
-	if percentage > .75:
-		quartile = "top"
-	elif .5 > percentage >=.75:
-		quartile = "second"
-	elif .25 > percentage >= .5:
-		quartile = "third"
-	else:
-		quartile = "last"
-	return quartile
+class DeckTemplate(object):
+	''' The base presentation and its static media, loaded once per process.
+	Each new deck is a deep copy of this warm state, so the default template
+	package is not re-parsed and the cover image is not re-read or re-hashed.
+	'''
+
+	def __init__(self, cover_path):
+		self.ppt = Presentation()
+		self.cover = ImagePart.new(self.ppt.part.package, Image.from_file(cover_path))
+
+	def new_deck(self):
+		''' Returns a fresh (presentation, cover image part) pair.  The cover
+		part belongs to the new presentation's package and is only saved once
+		a slide uses it.
+		'''
+		return copy.deepcopy((self.ppt, self.cover))
+
+
+# DeckTemplate shared by every presenter in this process
+deck_template = None
+deck_template_lock = threading.Lock()
+
+def get_deck_template(directory):
+	''' Returns the process-wide DeckTemplate, loading it on first use
+	'''
+	global deck_template
+	with deck_template_lock:
+		if deck_template is None:
+			deck_template = DeckTemplate(f"{directory}/assets/cover.jpg")
+	return deck_template
+
+def add_image_part(slide, image_part, left, top, width=None, height=None):
+	''' Adds a picture to a slide from an image part already in its package.
+	Does what shapes.add_picture does after it has loaded and hashed the
+	image file, which is the part we want to skip.  This and add_quick_chart
+	use private SlideShapes methods, hence the python-pptx pin in README.md.
+	'''
+	shapes = slide.shapes
+	rId = slide.part.relate_to(image_part, RT.IMAGE)
+	pic = shapes._add_pic_from_image_part(image_part, rId, left, top, width, height)
+	shapes._recalculate_extents()
+	return shapes._shape_factory(pic)
+
+
+class MediaParts(object):
+	''' The image parts of one deck by SHA1, so an image shown on many slides
+	is stored once.  New parts are numbered from a counter rather than by
+	searching the whole package for a free name, which gets slower with
+	every slide.
+	'''
+
+	def __init__(self, package, parts=()):
+		''' parts are image parts belonging to package that no slide uses yet,
+		such as the template's cover
+		'''
+		self.package = package
+		self.parts = {part.sha1: part for part in parts}
+		numbers = [part.partname.idx or 0 for part in self.parts.values()]
+		numbers += [
+			part.partname.idx or 0 for part in package.iter_parts() if isinstance(part, ImagePart)
+		]
+		self.next_number = max(numbers, default=0) + 1
+
+	def image_part(self, blob):
+		''' The image part holding the image bytes, added if it is new
+		'''
+		image = Image.from_blob(blob)
+		part = self.parts.get(image.sha1)
+		if part is None:
+			part = ImagePart(
+				PackURI(f"/ppt/media/image{self.next_number}.{image.ext}"),
+				image.content_type,
+				self.package,
+				image.blob,
+				image.filename
+			)
+			self.next_number += 1
+			self.parts[image.sha1] = part
+		return part
+
+def remove_slides(ppt, first):
+	''' Remove every slide from index first on, along with its relationship.
+	Parts only those slides used are left out when the deck is saved.
+	'''
+	slide_ids = ppt.element.sldIdLst
+	for slide_id in list(slide_ids)[first:]:
+		slide_ids.remove(slide_id)
+		ppt.part.drop_rel(slide_id.rId)
+
+# Last chart number add_quick_chart gave out in each deck's package
+chart_numbers = weakref.WeakKeyDictionary()
+
+def freeze_slides(ppt, first):
+	''' Replace every slide from index first on, and the charts on them, with
+	plain parts holding their serialized XML.  The deck saves the same, but
+	a finished slide then holds a few KB of bytes instead of thousands of
+	lxml nodes.  Only public python-pptx APIs are used: see frozen_part.
+	Frozen slides cannot be edited any more.
+	'''
+	for slide_id in list(ppt.element.sldIdLst)[first:]:
+		slide_part = ppt.part.related_part(slide_id.rId)
+		charts = {}
+		for rel in slide_part.rels.values():
+			if not rel.is_external and rel.reltype == RT.CHART:
+				charts[rel.target_part] = frozen_part(rel.target_part) or rel.target_part
+		frozen = frozen_part(slide_part, charts)
+		if frozen is None:
+			continue
+		ppt.part.drop_rel(slide_id.rId)
+		slide_id.rId = ppt.part.relate_to(frozen, RT.SLIDE)
+
+def frozen_part(part, replacements=None):
+	''' A plain Part with the name, content type and serialized XML of part,
+	related to the same targets, or their replacements, under the same rIds
+	its XML refers to.  None if those rIds cannot be kept.
+	'''
+	replacements = replacements or {}
+	frozen = Part(part.partname, part.content_type, part.package, part.blob)
+	for rel in sorted(part.rels.values(), key=lambda rel: rId_number(rel.rId)):
+		if rel.is_external:
+			rId = frozen.relate_to(rel.target_ref, rel.reltype, is_external=True)
+		else:
+			rId = frozen.relate_to(replacements.get(rel.target_part, rel.target_part), rel.reltype)
+		if rId != rel.rId:
+			return None
+	return frozen
+
+def rId_number(rId):
+	return int(rId[3:]) if rId[3:].isdigit() else 0
+
+def add_quick_chart(slide, chart_type, x, y, cx, cy, chart_data):
+	''' Adds a chart to a slide as shapes.add_chart does, but numbers the
+	chart and workbook parts from a count of the charts on the deck's slides
+	instead of walking every part in the package twice.  Decks made from
+	DeckTemplate have no charts anywhere else.
+	'''
+	package = slide.part.package
+	number = chart_numbers.get(package)
+	if number is None:
+		number = sum(
+			1
+			for rel in package.presentation_part.rels.values() if rel.reltype == RT.SLIDE
+			for chart in rel.target_part.rels.values() if chart.reltype == RT.CHART
+		)
+	number += 1
+	chart_numbers[package] = number
+	chart_part = ChartPart.load(
+		PackURI(ChartPart.partname_template % number),
+		CT.DML_CHART,
+		package,
+		chart_data.xml_bytes(chart_type)
+	)
+	chart_part.chart_workbook.xlsx_part = EmbeddedXlsxPart(
+		PackURI(EmbeddedXlsxPart.partname_template % number),
+		EmbeddedXlsxPart.content_type,
+		package,
+		chart_data.xlsx_blob
+	)
+	shapes = slide.shapes
+	rId = slide.part.relate_to(chart_part, RT.CHART)
+	frame = shapes._add_chart_graphicFrame(rId, x, y, cx, cy)
+	shapes._recalculate_extents()
+	return shapes._shape_factory(frame)
+
+class QuickChartData(CategoryChartData):
+	''' CategoryChartData whose embedded workbook is written directly as a few
+	lines of SpreadsheetML rather than built with xlsxwriter.  The chart XML,
+	with its cached values, is the same either way; the workbook is only
+	opened when someone edits the chart's data in PowerPoint.
+	'''
+
+	@functools.cached_property
+	def _workbook_writer(self):
+		return QuickWorkbookWriter(self)
+
+
+class QuickWorkbookWriter(CategoryWorkbookWriter):
+	''' Writes the same Sheet1 layout as CategoryWorkbookWriter, categories
+	down column A and one column per series, into a minimal .xlsx.  Date or
+	multi-level categories fall back to xlsxwriter.
+	'''
+
+	@property
+	def xlsx_blob(self):
+		categories = self._chart_data.categories
+		if categories.depth != 1 or categories.are_dates:
+			return super().xlsx_blob
+		category_format = categories.number_format
+		formats = tuple(dict.fromkeys(["General", category_format] + [s.number_format for s in self._chart_data]))
+		style = {number_format: i for i, number_format in enumerate(formats)}
+
+		height = max([len(categories)] + [len(series) for series in self._chart_data])
+		rows = [[] for _ in range(height + 1)]
+		for row, category in enumerate(categories, 2):
+			rows[row - 1].append(sheet_cell(f"A{row}", category.label, style[category_format]))
+		for series in self._chart_data:
+			column = self._series_col_letter(series)
+			rows[0].append(sheet_cell(f"{column}1", series.name, 0))
+			for row, value in enumerate(series.values, 2):
+				rows[row - 1].append(sheet_cell(f"{column}{row}", value, style[series.number_format]))
+		sheet = "".join(
+			f'<row r="{r}">{"".join(cells)}</row>' for r, cells in enumerate(rows, 1) if cells
+		)
+
+		# Stored rather than deflated: the deck itself is deflated when saved,
+		# and compressing twice only costs time.  ZipInfo entries carry a fixed
+		# timestamp, so the same data always makes the same bytes.
+		buffer = io.BytesIO()
+		with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as xlsx:
+			for name, content in workbook_parts:
+				xlsx.writestr(zipfile.ZipInfo(name), content)
+			xlsx.writestr(zipfile.ZipInfo("xl/styles.xml"), workbook_styles(formats))
+			xlsx.writestr(zipfile.ZipInfo("xl/worksheets/sheet1.xml"), sheet_template.format(rows=sheet))
+		return buffer.getvalue()
+
+
+spreadsheet_ns = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+package_rels_ns = "http://schemas.openxmlformats.org/package/2006/relationships"
+office_rels_ns = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+xml_declaration = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+# The parts of a QuickWorkbookWriter workbook that never change
+workbook_parts = (
+	("[Content_Types].xml", xml_declaration +
+		'<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+		'<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+		'<Default Extension="xml" ContentType="application/xml"/>'
+		'<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+		'<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+		'<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+		'</Types>'),
+	("_rels/.rels", xml_declaration +
+		f'<Relationships xmlns="{package_rels_ns}">'
+		f'<Relationship Id="rId1" Type="{office_rels_ns}/officeDocument" Target="xl/workbook.xml"/>'
+		'</Relationships>'),
+	("xl/workbook.xml", xml_declaration +
+		f'<workbook xmlns="{spreadsheet_ns}" xmlns:r="{office_rels_ns}">'
+		'<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets>'
+		'</workbook>'),
+	("xl/_rels/workbook.xml.rels", xml_declaration +
+		f'<Relationships xmlns="{package_rels_ns}">'
+		f'<Relationship Id="rId1" Type="{office_rels_ns}/worksheet" Target="worksheets/sheet1.xml"/>'
+		f'<Relationship Id="rId2" Type="{office_rels_ns}/styles" Target="styles.xml"/>'
+		'</Relationships>'),
+)
+
+sheet_template = (xml_declaration +
+	f'<worksheet xmlns="{spreadsheet_ns}">'
+	'<cols><col min="1" max="1" width="10" customWidth="1"/></cols>'
+	'<sheetData>{rows}</sheetData>'
+	'</worksheet>'
+)
+
+@functools.lru_cache(maxsize=64)
+def workbook_styles(number_formats):
+	''' styles.xml with one cell format per number format, in order.  The
+	first should be General, the default for cells without a style.
+	'''
+	custom = [f for f in number_formats if f != "General"]
+	num_fmts = "".join(
+		f'<numFmt numFmtId="{164 + i}" formatCode="{xml_escape(f)}"/>' for i, f in enumerate(custom)
+	)
+	xfs = "".join(
+		'<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>' if f == "General"
+		else f'<xf numFmtId="{164 + custom.index(f)}" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+		for f in number_formats
+	)
+	return (xml_declaration +
+		f'<styleSheet xmlns="{spreadsheet_ns}">' +
+		(f'<numFmts count="{len(custom)}">{num_fmts}</numFmts>' if custom else '') +
+		'<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+		'<fills count="2"><fill><patternFill patternType="none"/></fill>'
+		'<fill><patternFill patternType="gray125"/></fill></fills>'
+		'<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+		'<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+		f'<cellXfs count="{len(number_formats)}">{xfs}</cellXfs>'
+		'<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+		'</styleSheet>'
+	)
+
+def sheet_cell(ref, value, style):
+	''' One <c> element: numbers as values, anything else as an inline string.
+	Missing and NaN values are left as empty cells.
+	'''
+	if value is None or (isinstance(value, float) and value != value):
+		return ""
+	attrs = f' s="{style}"' if style else ""
+	if isinstance(value, (int, float)) and not isinstance(value, bool):
+		return f'<c r="{ref}"{attrs}><v>{value!r}</v></c>'
+	return f'<c r="{ref}"{attrs} t="inlineStr"><is><t>{xml_escape(str(value))}</t></is></c>'
+
+
+def write_deck(data, target, company, directory="."):
+	''' Write deck bytes to a stream, stdout ("-"), or a path built from a
+	template with {id} and {name}.  Returns the path written, or None for
+	streams.
+	'''
+	if hasattr(target, "write"):
+		target.write(data)
+		return None
+	if target == "-":
+		sys.stdout.buffer.write(data)
+		sys.stdout.buffer.flush()
+		return None
+	path = deck_path(target, company, directory)
+	write_file(path, data)
+	return path
+
+def deck_path(target, company, directory="."):
+	''' The file a path template with {id} and {name} names for a company
+	'''
+	return os.path.join(
+		directory,
+		target.format(id=company.id, name=safe_filename(company.name or company.id))
+	)
+
+def current_umask():
+	umask = os.umask(0)
+	os.umask(umask)
+	return umask
+
+# Mode for decks and their fingerprints, as open() would create them.  Read
+# once at import, since os.umask can only be read by setting it.
+file_mode = 0o666 & ~current_umask()
+
+def write_file(path, data):
+	''' Files are written to a temporary name and renamed into place so
+	concurrent renders never see a partial deck.  The temporary file is
+	private to the user, so it gets the usual mode before the rename.
+	'''
+	folder = os.path.dirname(path)
+	os.makedirs(folder, exist_ok=True)
+	fd, tmp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+	try:
+		with os.fdopen(fd, "wb") as f:
+			f.write(data)
+		os.chmod(tmp, file_mode)
+		os.replace(tmp, path)
+	except BaseException:
+		os.remove(tmp)
+		raise
+
+def fingerprints_path(path):
+	''' Where the input fingerprints of the deck at path are kept
+	'''
+	return f"{path}.fingerprints.json"
+
+def load_fingerprints(path):
+	''' The fingerprints saved with the deck at path, or {} if there are none
+	'''
+	try:
+		with open(fingerprints_path(path)) as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return {}
+
+def fingerprint(*inputs):
+	''' SHA-256 of a slide's inputs.  Bytes and arrays are hashed as they are
+	and everything else by its repr.
+	'''
+	digest = hashlib.sha256()
+	for value in inputs:
+		if isinstance(value, np.ndarray):
+			value = value.tobytes()
+		elif not isinstance(value, bytes):
+			value = repr(value).encode("utf-8")
+		digest.update(len(value).to_bytes(8, "big"))
+		digest.update(value)
+	return digest.hexdigest()
+
+def safe_filename(name):
+	''' Make a company name usable as a file name on any platform
+	'''
+	return re.sub(r'[\\/:*?"<>|\x00-\x1f]', "_", name).strip(" .") or "deck"
+
+
+class DeckResult(object):
+	''' Outcome of rendering one company's deck in batch mode.
+	'''
+	def __init__(
+		self, 
+		company_id, 
+		name=None, 
+		path=None, 
+		error=None, 
+		seconds=0, 
+		cache_stats=None,
+		unchanged=False
+		):
+		self.company_id = company_id
+		self.name = name
+		self.path = path
+		self.error = error
+		self.seconds = seconds
+		self.cache_stats = cache_stats or {}
+		self.unchanged = unchanged
+
+	@property
+	def ok(self):
+		return self.error is None
+
+
+class BatchPresenter(object):
+	''' Renders decks for many companies by fanning them out to a pool of
+	worker processes.  Each worker keeps one DeckbotPresenter for its lifetime.
+	Metric details fetched for one company are shared with the rest of its
+	peer group through models.peer_store.
+	'''
+
+	def __init__(self, view=None, workers=None, target=None, force=False):
+		self.view = view
+		self.workers = workers or os.cpu_count() or 1
+		self.target = target
+		self.force = force
+
+	def run(self, company_ids):
+		''' Render a deck for every company id.  Results are reported to the view
+		as they finish, followed by a summary.  Returns the list of DeckResults.
+
+		company_ids may be a generator, such as one streaming the companies
+		listing.  Ids are taken from it only while fewer than four per worker
+		are waiting, so rendering starts with the first ids and a long listing
+		is never held in memory.
+		'''
+		# Make sure a valid token is persisted before the workers start so
+		# they all pick it up instead of logging in.
+		models.get_token()
+		results = []
+		start = time.perf_counter()
+		with ProcessPoolExecutor(
+			max_workers=self.workers, 
+			initializer=init_worker, 
+			initargs=(self.target, self.force, True, worker_settings(self.workers))
+		) as pool:
+			pending = set()
+			for company_id in company_ids:
+				pending.add(pool.submit(render_company, company_id))
+				if len(pending) >= self.workers * 4:
+					done, pending = wait(pending, return_when=FIRST_COMPLETED)
+					for future in done:
+						results.append(future.result())
+						self.view.report_result(results[-1])
+			for future in as_completed(pending):
+				results.append(future.result())
+				self.view.report_result(results[-1])
+		self.view.report_summary(results, time.perf_counter() - start)
+		return results
+
+
+class CombinedPresenter(object):
+	''' Renders many companies into one deck, with a title, overview and
+	revenue slide for each in the order given.  Company data is fetched a
+	few companies ahead on a thread pool and let go as soon as its slides are
+	built, and finished slides are kept as serialized XML, so memory grows by
+	a few KB per slide.  The cover image and any logo used by more than one
+	company are stored once.
+	'''
+	default_output = "exports/combined.pptx"
+
+	def __init__(self, view=None, target=None, lookahead=4):
+		''' target is a path, "-" for stdout or a writable binary stream.
+		lookahead is how many companies are fetched ahead of the one being
+		rendered.
+		'''
+		self.view = view
+		self.target = target or self.default_output
+		self.lookahead = lookahead
+		self.presenter = DeckbotPresenter()
+
+	def run(self, company_ids):
+		''' Render every company into one deck and write it to target.  A
+		company whose data cannot be fetched or whose slides fail is left out
+		and reported.  Returns the list of DeckResults.
+		'''
+		models.get_token()
+		models.start_peer_sharing()
+		start = time.perf_counter()
+		cache_before = get_cache_stats()
+		path = None
+		if not hasattr(self.target, "write") and self.target != "-":
+			path = os.path.join(self.presenter.dir, self.target)
+		results = []
+		with tracing.span("combined deck", "deck"):
+			with tracing.span("template copy", "render"):
+				ppt, cover = get_deck_template(self.presenter.dir).new_deck()
+			media = MediaParts(ppt.part.package, [cover])
+			with ThreadPoolExecutor(max_workers=self.lookahead) as pool:
+				for company_id, fetched, seconds in self.fetch_ahead(pool, company_ids):
+					result = self.add_company(ppt, cover, media, company_id, fetched, seconds)
+					result.path = path if result.ok else None
+					results.append(result)
+					self.view.report_result(result)
+			with tracing.span("ppt.save", "render"):
+				buffer = io.BytesIO()
+				ppt.save(buffer)
+				tracing.annotate(bytes=buffer.tell(), slides=len(ppt.slides))
+		if path is None:
+			write_deck(buffer.getvalue(), self.target, None)
+		else:
+			write_file(path, buffer.getvalue())
+		cache_after = get_cache_stats()
+		self.view.report_combined(
+			results,
+			time.perf_counter() - start,
+			path,
+			len(ppt.slides),
+			{k: cache_after[k] - cache_before.get(k, 0) for k in cache_after}
+		)
+		return results
+
+	def fetch_ahead(self, pool, company_ids):
+		''' Yields (company_id, Company or exception, seconds) in order, keeping
+		up to lookahead companies fetching in the background
+		'''
+		pending = collections.deque()
+		for company_id in company_ids:
+			pending.append((company_id, pool.submit(self.fetch, company_id)))
+			if len(pending) > self.lookahead:
+				yield self.collect(*pending.popleft())
+		while pending:
+			yield self.collect(*pending.popleft())
+
+	def fetch(self, company_id):
+		start = time.perf_counter()
+		company = self.presenter.get_company_details(models.Company(company_id))
+		return company, time.perf_counter() - start
+
+	def collect(self, company_id, future):
+		try:
+			company, seconds = future.result()
+		except Exception as e:
+			return company_id, e, 0
+		return company_id, company, seconds
+
+	def add_company(self, ppt, cover, media, company_id, company, seconds):
+		''' Append one company's slides and freeze them.  Slides already added
+		for a company that fails part way through are removed again.
+		'''
+		if isinstance(company, Exception):
+			return DeckResult(company_id, error=f"{type(company).__name__}: {company}", seconds=seconds)
+		start = time.perf_counter()
+		first = len(ppt.slides)
+		error = None
+		try:
+			with tracing.span("company slides", "render", company_id=company_id):
+				self.presenter.build_title_slide(ppt, company, cover=cover, media=media)
+				self.presenter.build_overview_slide(ppt, company)
+				self.presenter.build_revenue_slide(ppt, company)
+		except Exception as e:
+			remove_slides(ppt, first)
+			error = f"{type(e).__name__}: {e}"
+		else:
+			freeze_slides(ppt, first)
+		return DeckResult(
+			company_id,
+			company.name,
+			error=error,
+			seconds=seconds + time.perf_counter() - start
+		)
+
+
+class SyncPresenter(object):
+	''' Copies companies from the API into the offline snapshot on a pool of
+	threads, so their decks can later be rendered with no network.  Only the
+	metrics the slides chart are synced.
+
+	Syncs are incremental: every overview is polled with a conditional GET,
+	and only companies that have reported a quarter since the last sync are
+	fetched in full.  Those whose decks no longer show their latest quarter,
+	and the companies whose charts show a company that reported, are queued
+	for prerender, so a run's cost follows reporting activity rather than the
+	size of the catalogue.
+	'''
+
+	def __init__(self, view=None, workers=None):
+		self.view = view
+		self.workers = workers or 8
+
+	def run(self, company_ids, full=False):
+		''' Sync every company id, reporting each to the view as it finishes,
+		then queue the decks that need rendering again.  With full, every
+		company is fetched in full whether it has reported or not.  Returns
+		the list of DeckResults, whose path is the snapshot file and which
+		are unchanged for companies that have not reported.
+		'''
+		# No token up front: the first request logs in, and the workers are
+		# threads sharing one TokenManager, so an empty run needs no login.
+		store = models.get_snapshot_store()
+		results = []
+		start = time.perf_counter()
+		with ThreadPoolExecutor(max_workers=self.workers) as pool:
+			pending = set()
+			for company_id in company_ids:
+				pending.add(pool.submit(self.sync, store, company_id, full))
+				if len(pending) >= self.workers * 4:
+					done, pending = wait(pending, return_when=FIRST_COMPLETED)
+					for future in done:
+						results.append(future.result())
+						self.view.report_result(results[-1])
+			for future in as_completed(pending):
+				results.append(future.result())
+				self.view.report_result(results[-1])
+
+		synced = [r.company_id for r in results if r.ok]
+		reported = [r.company_id for r in results if r.ok and not r.unchanged]
+		store.enqueue(store.unrendered(synced), "reported")
+		store.enqueue(store.peers(DeckbotPresenter.required_metrics, reported), "peer reported")
+		self.view.report_sync(results, time.perf_counter() - start, store.path, len(store.queued()))
+		return results
+
+	def sync(self, store, company_id, full=False):
+		start = time.perf_counter()
+		name = error = None
+		reported = False
+		try:
+			with tracing.span("sync", "fetch", company_id=company_id):
+				name, reported = models.sync_company(
+					store, company_id, DeckbotPresenter.required_metrics, full
+				)
+		except Exception as e:
+			error = f"{type(e).__name__}: {e}"
+		return DeckResult(
+			company_id,
+			name,
+			store.path if error is None else None,
+			error,
+			seconds=time.perf_counter() - start,
+			unchanged=not reported
+		)
 
+	def prerender(self, target=None, force=False):
+		''' Render the queued decks from the snapshot on a BatchPresenter and
+		take each one that succeeds off the queue.  Rendering is offline from
+		here on in this process.  Returns the list of DeckResults.
+		'''
+		store = models.start_offline()
+		queued = store.queued()
+		if not queued:
+			return []
+		batch = BatchPresenter(view=self.view, workers=None, target=target, force=force)
+		results = batch.run(queued)
+		for result in results:
+			if result.ok:
+				store.mark_rendered(result.company_id)
+		return results
+
+
+# Presenter and output path template owned by each batch or service worker
+# process, set by init_worker.
+worker_presenter = None
+worker_target = None
+
+def worker_settings(workers=1):
+	''' The command line settings each of a pool of workers processes must
+	share with this one, for init_worker.  Spawned workers (the default on
+	macOS and Windows) start from a fresh import, so they have none of them
+	otherwise.
+	'''
+	settings = models.worker_settings(workers)
+	settings["trace"] = tracing.spool_path()
+	return settings
+
+def init_worker(target=None, force=False, share_peers=False, settings=None):
+	''' Set up a batch or service worker process, loading the deck template
+	before the first company arrives.  settings come from worker_settings()
+	in the parent.  With share_peers, metric details are shared with the
+	other workers through models.start_peer_sharing.
+	'''
+	global worker_presenter, worker_target
+	if settings is not None:
+		models.apply_worker_settings(settings)
+		tracing.join(settings["trace"])
+	worker_presenter = DeckbotPresenter(force=force)
+	worker_target = target
+	if share_peers:
+		models.start_peer_sharing()
+	get_deck_template(worker_presenter.dir)
+
+def render_company_deck(company_id):
+	''' Fetch and render one deck inside a service worker.  Returns the company
+	name and the .pptx bytes; errors propagate to the caller.
+	'''
+	company = models.Company(company_id)
+	worker_presenter.get_company_details(company)
+	return company.name, worker_presenter.render_deck(company)
+
+def render_company(company_id):
+	''' Render one deck inside a batch worker.  Any failure is captured in the
+	returned DeckResult so one bad company does not stop the batch.
+	'''
+	start = time.perf_counter()
+	cache_before = get_cache_stats()
+	unchanged = worker_presenter.unchanged
+	company = models.Company(company_id)
+	path = error = None
+	try:
+		path = worker_presenter.make_deck(company, worker_target)
+	except Exception as e:
+		error = f"{type(e).__name__}: {e}"
+	cache_after = get_cache_stats()
+	return DeckResult(
+		company_id, 
+		company.name, 
+		path, 
+		error, 
+		seconds=time.perf_counter() - start, 
+		cache_stats={k: cache_after[k] - cache_before.get(k, 0) for k in cache_after},
+		unchanged=worker_presenter.unchanged > unchanged
+	)
+
+def get_cache_stats():
+	''' Current response cache and peer store counters for this process, for
+	whichever of them are on.  Neither is used offline.
+	'''
+	stats = {}
+	response_cache = models.get_cache()
+	if response_cache is not None and models.snapshot_store is None:
+		stats.update(response_cache.stats())
+	if models.peer_store is not None:
+		for counter, value in models.peer_store.stats().items():
+			stats[f"peer_{counter}"] = value
+	return stats
 
-# Split Paragraphs into Sentences 
+
+def chart_values(values):
+	''' A numpy array as chart series values, None where a value is missing
+	so the chart leaves that point out rather than writing NaN.
+	'''
+	return [None if np.isnan(value) else value for value in values.tolist()]
+
+
+def get_quartile(quartile):
+	''' Describe a quartile number from PeerChart.quartile, 1 being the top. '''
+	return {1: "top", 2: "second", 3: "third"}.get(quartile, "last")
+
+
+# Split Paragraphs into Sentences
+# The rules run in this order because each one sees the <prd>/<stop> markers
+# left by the ones before it.  Where a rule only turns periods into <prd>,
+# its pattern starts at the period and checks what comes before it with a
+# lookbehind, which lets the regex engine skip straight from one period to
+# the next instead of trying a match at every letter.  split_into_sentences
+# remembers recent descriptions since the same company is often rendered
+# many times.
 alphabets= "([A-Za-z])"
-prefixes = "(Mr|St|Mrs|Ms|Dr)[.]"
+prefixes = "(?:(?<=Mr[.])|(?<=St[.])|(?<=Mrs[.])|(?<=Ms[.])|(?<=Dr[.]))"
 suffixes = "(Inc|Ltd|Jr|Sr|Co)"
-starters = "(Mr|Mrs|Ms|Dr|He\s|She\s|It\s|They\s|Their\s|Our\s|We\s|But\s|However\s|That\s|This\s|Wherever)"
+starters = r"(Mr|Mrs|Ms|Dr|He\s|She\s|It\s|They\s|Their\s|Our\s|We\s|But\s|However\s|That\s|This\s|Wherever)"
 acronyms = "([A-Z][.][A-Z][.](?:[A-Z][.])?)"
 websites = "[.](com|net|org|io|gov)"
+initial = "(?<=[A-Za-z][.])"
+
+sentence_rules = [(re.compile(pattern), replacement) for pattern, replacement in (
+	("[.]" + prefixes, "<prd>"),
+	(websites, "<prd>\\1"),
+	# "Ph.D." is marked just before this rule
+	(r"\s" + alphabets + "[.] ", " \\1<prd> "),
+	(acronyms + " " + starters, "\\1<stop> \\2"),
+	("[.]" + initial + alphabets + "[.]" + alphabets + "[.]", "<prd>\\1<prd>\\2<prd>"),
+	("[.]" + initial + alphabets + "[.]", "<prd>\\1<prd>"),
+	(" " + suffixes + "[.] " + starters, " \\1<stop> \\2"),
+	("[.](?:(?<= Inc[.])|(?<= Ltd[.])|(?<= Jr[.])|(?<= Sr[.])|(?<= Co[.]))", "<prd>"),
+	("[.](?<= [A-Za-z][.])", "<prd>"),
+)]
+initials_rule = sentence_rules[2][0]
+
 
 def split_into_sentences(text):
 	''' Splits a paragraph into a list of sentences.'''
-	text = " " + text + "  "
-	text = text.replace("\n"," ")
-	text = re.sub(prefixes,"\\1<prd>",text)
-	text = re.sub(websites,"<prd>\\1",text)
-	if "Ph.D" in text: text = text.replace("Ph.D.","Ph<prd>D<prd>")
-	text = re.sub("\s" + alphabets + "[.] "," \\1<prd> ",text)
-	text = re.sub(acronyms+" "+starters,"\\1<stop> \\2",text)
-	text = re.sub(alphabets + "[.]" + alphabets + "[.]" + alphabets + "[.]","\\1<prd>\\2<prd>\\3<prd>",text)
-	text = re.sub(alphabets + "[.]" + alphabets + "[.]","\\1<prd>\\2<prd>",text)
-	text = re.sub(" "+suffixes+"[.] "+starters," \\1<stop> \\2",text)
-	text = re.sub(" "+suffixes+"[.]"," \\1<prd>",text)
-	text = re.sub(" " + alphabets + "[.]"," \\1<prd>",text)
-	if "\"" in text: text = text.replace(".\"","\".")
-	if "!" in text: text = text.replace("!\"","\"!")
-	if "?" in text: text = text.replace("?\"","\"?")
-	text = text.replace(".",".<stop>")
-	text = text.replace("?","?<stop>")
-	text = text.replace("!","!<stop>")
-	text = text.replace("<prd>",".")
-	sentences = text.split("<stop>")
-	sentences = sentences[:-1]
-	sentences = [s.strip() for s in sentences]
-	return sentences
\ No newline at end of file
+	return list(cached_sentences(text))
+
+
+@functools.lru_cache(maxsize=4096)
+def cached_sentences(text):
+	return tuple(tokenize_sentences(text))
+
+
+def tokenize_sentences(text):
+	''' Does the splitting for split_into_sentences, without the cache '''
+	text = " " + text.replace("\n"," ") + "  "
+	for pattern, replacement in sentence_rules:
+		if "." not in text:
+			break
+		if pattern is initials_rule and "Ph.D" in text:
+			text = text.replace("Ph.D.","Ph<prd>D<prd>")
+		text = pattern.sub(replacement, text)
+	if "\"" in text:
+		text = text.replace(".\"","\".")
+		if "!" in text: text = text.replace("!\"","\"!")
+		if "?" in text: text = text.replace("?\"","\"?")
+	text = text.replace(".",".<stop>").replace("?","?<stop>").replace("!","!<stop>")
+	sentences = text.replace("<prd>",".").split("<stop>")
+	return [s.strip() for s in sentences[:-1]]
@@ -0,0 +1,130 @@
+#----------------------------------------------------------------------------
+# Name:        service.py
+# Purpose:     HTTP Service Returning Decks for a Company ID
+# Author:    Drew Fulton
+# Created:    October 2026
+
+import os, re, threading, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import models
+import presenters
+
+PPTX_TYPE = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+
+
+class DeckService(ThreadingHTTPServer):
+    ''' Long running HTTP service that renders decks on a bounded pool of warm
+    worker processes.  Each worker keeps its presenter, deck template, token
+    and caches between requests, so only the first deck pays start-up costs.
+
+    GET /decks/{company_id} returns the .pptx; GET /health returns ok.
+    '''
+    daemon_threads = True
+
+    def __init__(self, address, workers=None, max_pending=None):
+        super().__init__(address, DeckRequestHandler)
+        self.workers = workers or os.cpu_count() or 1
+        # Requests beyond this many rendering or queued get a 503.
+        self.slots = threading.BoundedSemaphore(max_pending or self.workers * 4)
+        self.pool = None
+
+    def start(self):
+        ''' Log in once and start the worker processes before taking requests.
+        Returns once every worker has loaded the deck template.
+        '''
+        models.get_token()
+        ready = multiprocessing.Barrier(self.workers + 1)
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=init_service_worker,
+            initargs=(ready, presenters.worker_settings(self.workers))
+        )
+        # Workers may only be started as tasks arrive, so send one per worker.
+        warm = [self.pool.submit(os.getpid) for _ in range(self.workers)]
+        ready.wait(timeout=120)
+        for w in warm:
+            w.result()
+
+    def render(self, company_id):
+        ''' Render a deck on the worker pool.  Returns (name, bytes), or None if
+        the service is already at capacity.
+        '''
+        if not self.slots.acquire(blocking=False):
+            return None
+        try:
+            return self.pool.submit(presenters.render_company_deck, company_id).result()
+        finally:
+            self.slots.release()
+
+    def serve(self):
+        self.start()
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server_close()
+            self.pool.shutdown(cancel_futures=True)
+
+
+class DeckRequestHandler(BaseHTTPRequestHandler):
+    ''' Maps HTTP requests onto DeckService
+    '''
+    protocol_version = "HTTP/1.1"
+    deck_path = re.compile(r"^/decks/([A-Za-z0-9_-]+)/?$")
+
+    def do_GET(self):
+        if self.path == "/health":
+            return self.send_text(200, "ok")
+        match = self.deck_path.match(self.path.split("?")[0])
+        if match is None:
+            return self.send_text(404, "Not found")
+        company_id = match.group(1)
+        try:
+            rendered = self.server.render(company_id)
+        except models.DatabookHTTPError as e:
+            if e.status_code == 500:
+                return self.send_text(404, f"Unknown company {company_id}")
+            return self.send_text(502, str(e))
+        except models.DatabookError as e:
+            return self.send_text(502, str(e))
+        except Exception as e:
+            return self.send_text(500, f"{type(e).__name__}: {e}")
+        if rendered is None:
+            return self.send_text(503, "Too many decks in progress", {"Retry-After": "1"})
+        name, data = rendered
+        self.send(200, data, PPTX_TYPE, {
+            "Content-Disposition": content_disposition(f"{name or company_id}-{company_id}.pptx")
+        })
+
+    def send_text(self, status, text, headers=None):
+        self.send(status, text.encode("utf-8"), "text/plain; charset=utf-8", headers)
+
+    def send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def init_service_worker(ready, settings):
+    ''' presenters.init_worker for a DeckService worker, which then waits at
+    the ready barrier with the other workers and DeckService.start
+    '''
+    presenters.init_worker(settings=settings)
+    ready.wait(timeout=120)
+
+
+def content_disposition(filename):
+    ''' Attachment header for a deck.  filename is made safe for any file
+    system and sent in UTF-8 (RFC 5987), with an ASCII copy for old clients.
+    '''
+    filename = presenters.safe_filename(filename)
+    fallback = filename.encode("ascii", "replace").decode("ascii").replace("?", "_")
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
@@ -0,0 +1,345 @@
+#----------------------------------------------------------------------------
+# Name:        snapshot.py
+# Purpose:     Local SQLite Snapshot of Databook Data for Offline Rendering
+# Author:    Drew Fulton
+# Created:    October 2026
+
+import os, json, time, sqlite3, threading
+
+# Overview fields kept in columns of their own, by API name
+overview_columns = (
+    ("name", "name"),
+    ("description", "description"),
+    ("employees", "employees"),
+    ("currency", "currency"),
+    ("type", "type"),
+    ("website", "website"),
+    ("address", "address"),
+    ("currentQuarter", "current_quarter"),
+    ("quarterEnd", "quarter_end"),
+    ("fiscalYearEnd", "fiscal_year_end"),
+    ("logoUrl", "logo_url"),
+)
+
+# Reported values in the overview, each stored as quarter, year and USD columns
+reported_columns = (
+    ("latestRevenue", "latest_revenue"),
+    ("latestRevenueGrowth", "latest_revenue_growth"),
+)
+
+schema = f"""
+CREATE TABLE IF NOT EXISTS companies (
+    id TEXT PRIMARY KEY,
+    {", ".join(f"{column}" for field, column in overview_columns)},
+    {", ".join(f"{column}_quarter, {column}_year, {column}_usd" for field, column in reported_columns)},
+    synced_at REAL
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    company_id TEXT,
+    metric_id TEXT,
+    position INTEGER,
+    name TEXT,
+    description TEXT,
+    PRIMARY KEY (company_id, metric_id)
+);
+CREATE INDEX IF NOT EXISTS metrics_by_name ON metrics (name, company_id);
+CREATE TABLE IF NOT EXISTS details (
+    company_id TEXT,
+    metric TEXT,
+    description TEXT,
+    charts INTEGER,
+    synced_at REAL,
+    PRIMARY KEY (company_id, metric)
+);
+CREATE TABLE IF NOT EXISTS chart_columns (
+    company_id TEXT,
+    metric TEXT,
+    chart INTEGER,
+    col INTEGER,
+    label TEXT,
+    period TEXT,
+    groups TEXT,
+    PRIMARY KEY (company_id, metric, chart, col)
+);
+CREATE TABLE IF NOT EXISTS chart_members (
+    company_id TEXT,
+    metric TEXT,
+    chart INTEGER,
+    row INTEGER,
+    member TEXT,
+    member_id TEXT,
+    member_name TEXT,
+    PRIMARY KEY (company_id, metric, chart, row)
+);
+CREATE INDEX IF NOT EXISTS chart_members_by_member ON chart_members (metric, member);
+CREATE TABLE IF NOT EXISTS series (
+    metric TEXT,
+    member TEXT,
+    label TEXT,
+    period TEXT,
+    value REAL,
+    PRIMARY KEY (metric, member, label)
+);
+CREATE INDEX IF NOT EXISTS series_by_period ON series (metric, period, label);
+CREATE TABLE IF NOT EXISTS logos (
+    url TEXT PRIMARY KEY,
+    content BLOB,
+    synced_at REAL
+);
+CREATE TABLE IF NOT EXISTS renders (
+    company_id TEXT PRIMARY KEY,
+    reporting TEXT,
+    rendered_at REAL
+);
+CREATE TABLE IF NOT EXISTS render_queue (
+    company_id TEXT PRIMARY KEY,
+    reason TEXT,
+    queued_at REAL
+);
+"""
+
+
+class SnapshotStore(object):
+    ''' Company overviews, metric lists and metric time series saved in a
+    SQLite file, so decks can be rendered with no network at all.  Details
+    responses are split into their peer-group membership and one row per
+    company, metric and period, so a company's chart shows the latest
+    figures synced for each of its peers.  A queue of companies whose decks
+    need rendering again is kept alongside.  Each thread and process opens
+    its own connection.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self.connect() as db:
+            db.executescript(schema)
+
+    def connect(self):
+        ''' This thread's connection, opened on first use
+        '''
+        db = getattr(self.local, "db", None)
+        if db is None or self.local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db, self.local.pid = db, os.getpid()
+        return db
+
+    def save_overview(self, overview, synced_at=None):
+        ''' Store an overview response
+        '''
+        row = [overview["_id"]]
+        row += [overview.get(field) for field, column in overview_columns]
+        for field, column in reported_columns:
+            reported = overview.get(field) or {}
+            row += [reported.get("quarter"), reported.get("year"), reported.get("valueUSD")]
+        row.append(synced_at or time.time())
+        with self.connect() as db:
+            db.execute(f"INSERT OR REPLACE INTO companies VALUES ({', '.join('?' * len(row))})", row)
+
+    def save_metrics(self, company_id, metrics):
+        ''' Store a metric list response, replacing the company's last one
+        '''
+        with self.connect() as db:
+            db.execute("DELETE FROM metrics WHERE company_id = ?", (company_id,))
+            db.executemany(
+                "INSERT INTO metrics VALUES (?, ?, ?, ?, ?)",
+                [
+                    (company_id, m["_id"], position, m.get("name"), m.get("description"))
+                    for position, m in enumerate(metrics)
+                ]
+            )
+
+    def save_details(self, company_id, metric, details, synced_at=None):
+        ''' Store a metric details response fetched for company_id.  Every
+        value it charts updates that company's series for the metric.
+        '''
+        columns, members, series = [], [], []
+        charts = details.get("chart", ())
+        for chart, content in enumerate(charts):
+            labels = {}
+            for row, company in enumerate(content.get("companies", ())):
+                member = member_key(company)
+                members.append((company_id, metric, chart, row, member, company.get("_id"), company["name"]))
+                for point in company["data"]:
+                    if point["label"] not in labels:
+                        labels[point["label"]] = len(labels)
+                        columns.append((
+                            company_id, metric, chart, labels[point["label"]], point["label"],
+                            point.get("period"), json.dumps(point.get("groups") or [])
+                        ))
+                    if point.get("value") is not None:
+                        series.append((metric, member, point["label"], point.get("period"), point["value"]))
+        with self.connect() as db:
+            for table in ("chart_columns", "chart_members"):
+                db.execute(f"DELETE FROM {table} WHERE company_id = ? AND metric = ?", (company_id, metric))
+            db.execute(
+                "INSERT OR REPLACE INTO details VALUES (?, ?, ?, ?, ?)",
+                (company_id, metric, details.get("description"), len(charts), synced_at or time.time())
+            )
+            db.executemany("INSERT INTO chart_columns VALUES (?, ?, ?, ?, ?, ?, ?)", columns)
+            db.executemany("INSERT INTO chart_members VALUES (?, ?, ?, ?, ?, ?, ?)", members)
+            db.executemany("INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?, ?)", series)
+
+    def save_logo(self, url, content):
+        with self.connect() as db:
+            db.execute("INSERT OR REPLACE INTO logos VALUES (?, ?, ?)", (url, content, time.time()))
+
+    def overview(self, company_id):
+        ''' The company's overview in the API's form, or None
+        '''
+        row = self.connect().execute("SELECT * FROM companies WHERE id = ?", (company_id,)).fetchone()
+        if row is None:
+            return None
+        overview = {"_id": row[0]}
+        for (field, column), value in zip(overview_columns, row[1:]):
+            overview[field] = value
+        offset = 1 + len(overview_columns)
+        for i, (field, column) in enumerate(reported_columns):
+            quarter, year, usd = row[offset + 3 * i:offset + 3 * i + 3]
+            if quarter is not None or year is not None or usd is not None:
+                overview[field] = {"quarter": quarter, "year": year, "valueUSD": usd}
+        return overview
+
+    def metrics(self, company_id):
+        ''' The company's metric list in the API's form, or None if it was
+        never synced
+        '''
+        rows = self.connect().execute(
+            "SELECT metric_id, name, description FROM metrics WHERE company_id = ? ORDER BY position",
+            (company_id,)
+        ).fetchall()
+        if not rows:
+            return None
+        return [{"_id": metric_id, "name": name, "description": description} for metric_id, name, description in rows]
+
+    def details(self, metric, company_id):
+        ''' The company's own metric details in the API's form, or None.
+        Chart values are read from the current series, so a peer synced since
+        the chart was stored shows its newer figures.
+        '''
+        db = self.connect()
+        row = db.execute(
+            "SELECT description, charts FROM details WHERE company_id = ? AND metric = ?", (company_id, metric)
+        ).fetchone()
+        if row is None:
+            return None
+        description, count = row
+        charts = [{"companies": []} for _ in range(count)]
+        columns = [[] for _ in range(count)]
+        for chart, label, period, groups in db.execute(
+            "SELECT chart, label, period, groups FROM chart_columns WHERE company_id = ? AND metric = ? ORDER BY chart, col",
+            (company_id, metric)
+        ):
+            columns[chart].append((label, period, json.loads(groups)))
+        values = {}
+        for chart, row, value, label in db.execute(
+            """SELECT m.chart, m.row, s.value, s.label FROM chart_members m
+            JOIN series s ON s.metric = m.metric AND s.member = m.member
+            WHERE m.company_id = ? AND m.metric = ?""",
+            (company_id, metric)
+        ):
+            values[chart, row, label] = value
+        for chart, row, member_id, member_name in db.execute(
+            "SELECT chart, row, member_id, member_name FROM chart_members WHERE company_id = ? AND metric = ? ORDER BY chart, row",
+            (company_id, metric)
+        ):
+            charts[chart]["companies"].append({
+                "_id": member_id,
+                "name": member_name,
+                "data": [
+                    {"label": label, "period": period, "groups": groups, "value": values.get((chart, row, label))}
+                    for label, period, groups in columns[chart]
+                ],
+            })
+        return {"name": metric, "description": description, "chart": charts}
+
+    def logo(self, url):
+        row = self.connect().execute("SELECT content FROM logos WHERE url = ?", (url,)).fetchone()
+        return row and row[0]
+
+    def company_records(self):
+        ''' (id, name) of every company with a synced overview
+        '''
+        return self.connect().execute("SELECT id, name FROM companies ORDER BY name").fetchall()
+
+    def peers(self, metrics, company_ids):
+        ''' Ids of the synced companies whose own charts for any of metrics
+        show any of company_ids, not counting company_ids themselves
+        '''
+        db = self.connect()
+        found = set()
+        for metric in metrics:
+            for company_id in company_ids:
+                found.update(row[0] for row in db.execute(
+                    """SELECT DISTINCT c.id FROM chart_members m
+                    JOIN companies c ON c.id = m.company_id
+                    WHERE m.metric = ? AND m.member = ?""",
+                    (metric, company_id)
+                ))
+        return found - set(company_ids)
+
+    def enqueue(self, company_ids, reason):
+        ''' Queue companies for pre-rendering.  A company already queued keeps
+        its place and its first reason.
+        '''
+        now = time.time()
+        with self.connect() as db:
+            db.executemany(
+                "INSERT OR IGNORE INTO render_queue VALUES (?, ?, ?)",
+                [(company_id, reason, now) for company_id in company_ids]
+            )
+
+    def queued(self):
+        ''' Ids of the queued companies, oldest first
+        '''
+        rows = self.connect().execute("SELECT company_id FROM render_queue ORDER BY queued_at, company_id")
+        return [row[0] for row in rows]
+
+    def unrendered(self, company_ids):
+        ''' Those of company_ids that have reported since their deck was last
+        rendered, or have never been rendered
+        '''
+        stale = []
+        for company_id in company_ids:
+            overview = self.overview(company_id)
+            row = self.connect().execute(
+                "SELECT reporting FROM renders WHERE company_id = ?", (company_id,)
+            ).fetchone()
+            if overview is not None and (row is None or row[0] != reporting_key(overview)):
+                stale.append(company_id)
+        return stale
+
+    def mark_rendered(self, company_id):
+        ''' Record that the company's deck shows its current quarter and take
+        it off the queue
+        '''
+        overview = self.overview(company_id)
+        with self.connect() as db:
+            if overview is not None:
+                db.execute(
+                    "INSERT OR REPLACE INTO renders VALUES (?, ?, ?)",
+                    (company_id, reporting_key(overview), time.time())
+                )
+            db.execute("DELETE FROM render_queue WHERE company_id = ?", (company_id,))
+
+
+def reporting_key(overview):
+    ''' What changes when a company reports a quarter: its latest revenue
+    period and its current quarter
+    '''
+    latest = overview.get("latestRevenue") or {}
+    return json.dumps([
+        latest.get("quarter"),
+        latest.get("year"),
+        overview.get("currentQuarter"),
+        overview.get("quarterEnd"),
+    ])
+
+
+def member_key(company):
+    ''' How a charted company is keyed in the series table: its id, or its
+    name when the chart has no id for it
+    '''
+    return company.get("_id") or f"name:{company['name']}"
@@ -0,0 +1,240 @@
+#----------------------------------------------------------------------------
+# Name:        standin.py
+# Purpose:     Record Databook API Responses and Replay Them Offline
+# Author:    Drew Fulton
+# Created:    October 2026
+#
+# Record fixtures with:  python deckbot.py --id <company_id> --record fixtures/
+# Replay them with:      python standin.py fixtures/ --port 8700 --latency 0.05
+# and point Deckbot at:  python deckbot.py --endpoint http://127.0.0.1:8700 ...
+
+import os, re, json, time, random, hashlib, mimetypes, threading, argparse, tempfile
+from urllib.parse import urlsplit
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+def fixture_path(directory, url):
+    ''' Where the fixture for a URL lives.  API responses are stored by their
+    path so the fixtures are easy to browse; anything else, such as a logo,
+    is stored under logos/ by a hash of its URL.
+    '''
+    path = urlsplit(url).path
+    if path.startswith("/api/"):
+        relative = path.strip("/") or "index"
+        if path.endswith("/"):
+            relative += "/index"
+        return os.path.join(directory, f"{relative}.json")
+    return os.path.join(directory, "logos", url_digest(url))
+
+
+def url_digest(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def save_fixture(directory, url, response):
+    ''' Save a successful response body as a fixture
+    '''
+    path = fixture_path(directory, url)
+    if not urlsplit(url).path.startswith("/api/"):
+        content_type = response.headers.get("Content-Type", "").split(";")[0]
+        path += mimetypes.guess_extension(content_type) or ".img"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(response.content)
+    os.replace(tmp, path)
+
+
+class StandinServer(ThreadingHTTPServer):
+    ''' Local stand-in for the Databook API that replays recorded fixtures.
+
+    latency and jitter (seconds) delay every response, error_rate and
+    throttle_rate are the fractions of API requests answered with 503 or 429,
+    and token_ttl expires issued tokens so the 401 refresh path gets used.
+    Unknown companies get a 500, as the real API does.  GET /_stats returns
+    request counters.
+    '''
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        fixtures,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        throttle_rate=0.0,
+        token_ttl=None,
+        seed=None
+        ):
+        super().__init__(address, StandinRequestHandler)
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.token_ttl = token_ttl
+        self.random = random.Random(seed)
+        self.tokens = {}
+        self.stats = {"requests": 0, "logins": 0, "401": 0, "429": 0, "503": 0, "304": 0}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, counter):
+        with self.lock:
+            self.stats[counter] += 1
+
+    def delay(self):
+        with self.lock:
+            seconds = self.random.gauss(self.latency, self.jitter) if self.jitter else self.latency
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def roll(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+    def issue_token(self):
+        with self.lock:
+            token = f"standin-{len(self.tokens) + 1}-{self.random.getrandbits(32):08x}"
+            self.tokens[token] = time.time()
+            self.stats["logins"] += 1
+        return token
+
+    def token_valid(self, token):
+        with self.lock:
+            issued = self.tokens.get(token)
+        if issued is None:
+            return False
+        return self.token_ttl is None or time.time() - issued < self.token_ttl
+
+    def load(self, path):
+        ''' Returns (body, content type) for a request path, or None
+        '''
+        if path.startswith("/logos/"):
+            name = os.path.basename(path)
+            full = os.path.join(self.fixtures, "logos", name)
+            content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        else:
+            full = fixture_path(self.fixtures, path)
+            content_type = "application/json"
+        try:
+            with open(full, "rb") as f:
+                body = f.read()
+        except OSError:
+            return None
+        if full.endswith(".json") and b'"logoUrl"' in body:
+            body = self.rewrite_logo(body)
+        return body, content_type
+
+    def rewrite_logo(self, body):
+        ''' Point an overview's logoUrl at its recorded copy on this server
+        '''
+        overview = json.loads(body)
+        logos = os.path.join(self.fixtures, "logos")
+        digest = url_digest(overview.get("logoUrl") or "")
+        if os.path.isdir(logos):
+            for name in os.listdir(logos):
+                if name.startswith(digest):
+                    overview["logoUrl"] = f"{self.url}/logos/{name}"
+                    break
+        return json.dumps(overview).encode("utf-8")
+
+
+class StandinRequestHandler(BaseHTTPRequestHandler):
+    ''' Serves fixtures for StandinServer
+    '''
+    protocol_version = "HTTP/1.1"
+    company_path = re.compile(r"^/api/companies/[^/]+$")
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if self.path != "/auth/local":
+            return self.send(404, b"{}")
+        self.server.delay()
+        token = self.server.issue_token()
+        self.send(200, json.dumps({"token": token}).encode("utf-8"))
+
+    def do_GET(self):
+        server = self.server
+        path = self.path.split("?")[0]
+        if path == "/_stats":
+            with server.lock:
+                return self.send(200, json.dumps(server.stats).encode("utf-8"))
+        server.count("requests")
+        server.delay()
+        if path.startswith("/api/"):
+            if server.roll(server.throttle_rate):
+                server.count("429")
+                return self.send(429, b"{}", extra={"Retry-After": "0"})
+            if server.roll(server.error_rate):
+                server.count("503")
+                return self.send(503, b"{}")
+            token = self.headers.get("Authorization", "")[len("Bearer "):]
+            if not server.token_valid(token):
+                server.count("401")
+                return self.send(401, b"{}")
+        loaded = server.load(path)
+        if loaded is None:
+            if self.company_path.match(path.rstrip("/")):
+                return self.send(500, b"{}")
+            return self.send(404, b"{}")
+        body, content_type = loaded
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if self.headers.get("If-None-Match") == etag:
+            server.count("304")
+            return self.send(304, b"", extra={"ETag": etag})
+        self.send(200, body, content_type, {"ETag": etag})
+
+    def send(self, status, body, content_type="application/json", extra=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (extra or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded Databook API fixtures")
+    parser.add_argument("fixtures", help="Directory written by deckbot.py --record")
+    parser.add_argument("--host", default="127.0.0.1", type=str)
+    parser.add_argument("--port", default=8700, type=int)
+    parser.add_argument("--latency", default=0.0, type=float,
+        help="Seconds added to every response")
+    parser.add_argument("--jitter", default=0.0, type=float,
+        help="Standard deviation of the added latency, in seconds")
+    parser.add_argument("--error-rate", default=0.0, type=float,
+        help="Fraction of API requests answered with a 503")
+    parser.add_argument("--throttle-rate", default=0.0, type=float,
+        help="Fraction of API requests answered with a 429")
+    parser.add_argument("--token-ttl", default=None, type=float,
+        help="Seconds before an issued token starts getting 401s")
+    parser.add_argument("--seed", default=None, type=int,
+        help="Seed for latency and error injection, for repeatable runs")
+    args = parser.parse_args()
+
+    server = StandinServer(
+        (args.host, args.port),
+        args.fixtures,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        token_ttl=args.token_ttl,
+        seed=args.seed
+    )
+    print(f"Replaying {args.fixtures} at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,75 @@
+#----------------------------------------------------------------------------
+# Name:        conftest.py
+# Purpose:     Shared Fixtures for the Deckbot Tests
+# Author:    Drew Fulton
+# Created:    October 2026
+
+import io, os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+
+peer_names = ("Apple", "Samsung", "Dell", "HP", "Lenovo")
+
+
+def overview_response(company_id, name, quarter=4, year=2019, logo_url=None):
+    ''' An overview as the API returns it
+    '''
+    return {
+        "_id": company_id,
+        "name": name,
+        "description": "Makes phones. It sells them in the U.S. and abroad.",
+        "latestRevenue": {"quarter": quarter, "year": year, "valueUSD": 260.2},
+        "latestRevenueGrowth": {"quarter": quarter, "year": year},
+        "employees": 0.137,
+        "currency": "USD",
+        "type": "Public",
+        "website": "https://example.com",
+        "address": "Cupertino, CA",
+        "currentQuarter": 1,
+        "quarterEnd": "2020-03-28T00:00:00.000Z",
+        "fiscalYearEnd": 9,
+        "logoUrl": logo_url,
+    }
+
+
+def revenue_details(names=peer_names, scale=1.0):
+    ''' Revenue details charting every company in names, as the API returns
+    them.  Ids are "id" followed by the name.
+    '''
+    companies = []
+    for i, name in enumerate(names):
+        base = (50 + i * 40) * scale
+        companies.append({"_id": f"id{name}", "name": name, "data": [
+            {"label": "LTM Q4 2019", "period": "ltm", "groups": [], "value": base * 1.1},
+            {"label": "2019", "period": "y", "groups": ["Last 3 years"], "value": base * 1.05},
+            {"label": "2018", "period": "y", "groups": ["Last 3 years"], "value": base},
+            {"label": "2017", "period": "y", "groups": ["Last 3 years"], "value": base * 0.9},
+        ]})
+    return {"name": "Revenue", "description": "Total revenue\nfor the period.", "chart": [{"companies": companies}]}
+
+
+def jpeg(color):
+    ''' A small JPEG of one color
+    '''
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (40, 20), color).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def make_company():
+    ''' Builds a fully loaded Company without the API
+    '''
+    def make(name="Apple", logo=None, details=None):
+        company = models.Company(f"id{name}")
+        company.load_overview(overview_response(company.id, name))
+        company.load_metrics([{"_id": "m1", "name": "Revenue"}])
+        company.metrics["Revenue"].load_details(details or revenue_details())
+        company.logo_image = logo
+        return company
+    return make
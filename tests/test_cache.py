@@ -0,0 +1,98 @@
+#----------------------------------------------------------------------------
+# Name:        test_cache.py
+# Purpose:     Tests for the On-Disk Caches
+# Author:    Drew Fulton
+# Created:    October 2026
+
+import json, os
+
+import pytest
+
+import cache
+from conftest import revenue_details
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_peer_store_does_not_share_across_different_groups(tmp_path, clock):
+    peers = cache.PeerStore(str(tmp_path), ttl=100, group_ttl=1000, max_bytes=1 << 20)
+    peers.store("Revenue", "idApple", revenue_details(("Apple", "Dell", "HP")))
+    # Dell is in Apple's chart, but Dell's own peer group is unknown
+    assert peers.lookup("Revenue", "idDell") is None
+
+    peers.store("Revenue", "idDell", revenue_details(("Dell", "Lenovo")))
+    clock[0] += 200
+    peers.store("Revenue", "idApple", revenue_details(("Apple", "Dell", "HP"), scale=2))
+    # Dell's own group differs, so Apple's chart is still not used for it
+    assert peers.lookup("Revenue", "idDell") is None
+
+
+def test_peer_store_shares_within_the_same_group(tmp_path, clock):
+    group = ("Apple", "Dell", "HP")
+    peers = cache.PeerStore(str(tmp_path), ttl=100, group_ttl=1000, max_bytes=1 << 20)
+    peers.store("Revenue", "idDell", revenue_details(group))
+    clock[0] += 200
+    newer = revenue_details(group, scale=2)
+    peers.store("Revenue", "idApple", newer)
+    assert peers.lookup("Revenue", "idDell") == newer
+    # HP's own group has never been seen
+    assert peers.lookup("Revenue", "idHP") is None
+
+    clock[0] += 2000
+    peers.store("Revenue", "idApple", revenue_details(group, scale=3))
+    # Dell's group was last seen too long ago to be trusted
+    assert peers.lookup("Revenue", "idDell") is None
+
+
+def test_peer_store_counts_only_borrowed_details_as_hits(tmp_path, clock):
+    group = ("Apple", "Dell")
+    peers = cache.PeerStore(str(tmp_path), ttl=100, group_ttl=1000, max_bytes=1 << 20)
+    peers.store("Revenue", "idDell", revenue_details(group))
+    # Dell's own details expire, so it borrows Apple's
+    clock[0] += 200
+    peers.store("Revenue", "idApple", revenue_details(group))
+    assert peers.lookup("Revenue", "idApple") is not None
+    assert peers.lookup("Revenue", "idDell") is not None
+    assert peers.lookup("Revenue", "idHP") is None
+    stats = peers.stats()
+    assert (stats["hits"], stats["own"], stats["misses"]) == (1, 1, 1)
+
+
+def test_peer_store_evicts_the_oldest_details(tmp_path, clock):
+    size = len(json.dumps(revenue_details(), sort_keys=True))
+    peers = cache.PeerStore(str(tmp_path), ttl=100, group_ttl=1000, max_bytes=int(size * 2.5))
+    for scale in (1, 2, 3):
+        clock[0] += 10
+        peers.store("Revenue", "idApple", revenue_details(scale=scale))
+        # Older details were used longer ago
+        os.utime(peers.group_path(peers.read_member("Revenue", "idApple")["group"]), (clock[0], clock[0]))
+    assert len(list((tmp_path / "groups").iterdir())) == 2
+    assert peers.stats()["evictions"] == 1
+    assert peers.lookup("Revenue", "idApple") == revenue_details(scale=3)
+
+
+class FakeResponse(object):
+    headers = {}
+
+    def __init__(self, size):
+        self.content = b"x" * size
+
+
+def test_response_cache_scans_only_when_over_its_limit(tmp_path, monkeypatch):
+    responses = cache.ResponseCache(str(tmp_path), [(".", 60)], max_bytes=100000)
+    scans = []
+    listdir = os.listdir
+    monkeypatch.setattr(cache.os, "listdir", lambda path: scans.append(path) or listdir(path))
+    for i in range(60):
+        responses.store(f"https://example.com/{i}", FakeResponse(1000))
+    assert len(scans) == 1
+    for i in range(60, 90):
+        responses.store(f"https://example.com/{i}", FakeResponse(1000))
+    assert 1 < len(scans) <= 4
+    assert responses.stats()["evictions"] > 0
+    assert sum(f.stat().st_size for f in tmp_path.iterdir() if f.suffix == ".json") <= 100000
@@ -0,0 +1,25 @@
+#----------------------------------------------------------------------------
+# Name:        test_catalog.py
+# Purpose:     Tests for the Company Search Index
+# Author:    Drew Fulton
+# Created:    October 2026
+
+import catalog
+
+
+def records(*names):
+    return [{"id": f"id{name}", "name": name, "aliases": []} for name in names]
+
+
+def test_search_survives_a_refresh_that_drops_a_match(tmp_path, monkeypatch):
+    index = catalog.CompanyIndex(str(tmp_path / "index.json"), ttl=60)
+    index.update(records("Apple", "Applied Materials", "Dell"))
+    close_matches = catalog.difflib.get_close_matches
+
+    def refresh_midway(*args, **kwargs):
+        index.update(records("Dell"))
+        return close_matches(*args, **kwargs)
+
+    monkeypatch.setattr(catalog.difflib, "get_close_matches", refresh_midway)
+    assert [c["name"] for c in index.search("app")] == ["Apple", "Applied Materials"]
+    assert index.search("app") == []
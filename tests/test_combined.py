@@ -0,0 +1,52 @@
+#----------------------------------------------------------------------------
+# Name:        test_combined.py
+# Purpose:     Tests for Combined Decks
+# Author:    Drew Fulton
+# Created:    October 2026
+
+import zipfile
+
+import pytest
+from pptx import Presentation
+from pptx.opc.constants import RELATIONSHIP_TYPE as RT
+
+import models
+import presenters
+import views
+from conftest import jpeg
+
+
+@pytest.fixture
+def combined(monkeypatch, tmp_path, make_company):
+    ''' Writes a combined deck for Apple, Dell and HP to a temporary file,
+    with Apple and HP sharing a logo, and returns its path
+    '''
+    logos = {"Apple": jpeg("red"), "Dell": jpeg("blue"), "HP": jpeg("red")}
+    monkeypatch.setattr(models, "get_token", lambda: {})
+    monkeypatch.setattr(models, "start_peer_sharing", lambda: None)
+    monkeypatch.setattr(models, "get_cache", lambda: None)
+    path = tmp_path / "combined.pptx"
+    presenter = presenters.CombinedPresenter(view=views.DeckbotCLI(), target=str(path))
+    monkeypatch.setattr(
+        presenter, "fetch", lambda company_id: (make_company(company_id[2:], logo=logos[company_id[2:]]), 0)
+    )
+    results = presenter.run(["idApple", "idDell", "idHP"])
+    assert all(r.ok for r in results)
+    return path
+
+
+def test_combined_deck_round_trips(combined):
+    ppt = Presentation(str(combined))
+    assert len(ppt.slides) == 9
+    titles = [slide.shapes.title.text for slide in list(ppt.slides)[::3]]
+    assert titles == ["Apple - Factpack", "Dell - Factpack", "HP - Factpack"]
+    charts = [rel for slide in ppt.slides for rel in slide.part.rels.values() if rel.reltype == RT.CHART]
+    assert len(charts) == 6
+    assert all(rel.target_part.chart.plots for rel in charts)
+
+
+def test_combined_deck_stores_shared_media_once(combined):
+    names = zipfile.ZipFile(combined).namelist()
+    assert len(names) == len(set(names))
+    # The cover and two distinct logos
+    assert len([n for n in names if n.startswith("ppt/media/")]) == 3
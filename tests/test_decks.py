@@ -0,0 +1,78 @@
+#----------------------------------------------------------------------------
+# Name:        test_decks.py
+# Purpose:     Tests for Rendering Single Decks
+# Author:    Drew Fulton
+# Created:    October 2026
+
+import io, warnings, zipfile
+
+import pytest
+import requests
+from pptx import Presentation
+from pptx.enum.shapes import MSO_SHAPE_TYPE
+
+import models
+import presenters
+from conftest import jpeg, revenue_details
+
+
+def test_jpeg_logo_gets_its_own_media_part(make_company):
+    data = presenters.DeckbotPresenter().render_deck(make_company(logo=jpeg("red")))
+    names = zipfile.ZipFile(io.BytesIO(data)).namelist()
+    assert len(names) == len(set(names))
+    media = [n for n in names if n.startswith("ppt/media/")]
+    assert len(media) == 2
+    pictures = [s for s in Presentation(io.BytesIO(data)).slides[0].shapes if s.shape_type == MSO_SHAPE_TYPE.PICTURE]
+    assert len({p.image.sha1 for p in pictures}) == 2
+
+
+def test_deck_without_logo_has_only_the_cover(make_company):
+    data = presenters.DeckbotPresenter().render_deck(make_company())
+    names = zipfile.ZipFile(io.BytesIO(data)).namelist()
+    assert [n for n in names if n.startswith("ppt/media/")] == ["ppt/media/image1.jpg"]
+
+
+def test_revenue_slide_leaves_out_quartile_without_a_value(make_company):
+    details = revenue_details()
+    details["chart"][0]["companies"][0]["data"][0]["value"] = None
+    presenter = presenters.DeckbotPresenter()
+    ppt = presenter.build_revenue_slide(Presentation(), make_company(details=details))
+    text = " ".join(s.text_frame.text for s in ppt.slides[0].shapes if s.has_text_frame)
+    assert "quartile" not in text
+    assert "Apple Revenue grew" in text
+
+
+def test_last_three_years_chart_leaves_out_missing_values(make_company):
+    details = revenue_details()
+    for company in details["chart"][0]["companies"]:
+        company["data"][3]["value"] = None
+    details["chart"][0]["companies"][0]["data"][2]["value"] = None
+    for quick in (True, False):
+        presenter = presenters.DeckbotPresenter()
+        presenter.quick_charts = quick
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            ppt = presenter.build_revenue_slide(Presentation(), make_company(details=details))
+        data = io.BytesIO()
+        ppt.save(data)
+        chart = [s for s in Presentation(data).slides[0].shapes if s.has_chart][1].chart
+        apple, medians = chart.plots[0].series
+        assert apple.values == (None, None, 52.5)
+        assert medians.values[:2] == (None, 150.0)
+
+
+@pytest.mark.parametrize("logo_url, error", [
+    ("/logos/apple.png", None),
+    ("https://example.com/apple.png", requests.exceptions.ChunkedEncodingError("Connection broken")),
+])
+def test_logo_that_cannot_be_fetched_is_skipped(monkeypatch, make_company, logo_url, error):
+    transport = models.Transport(max_retries=0, rate_limit=0)
+    if error is not None:
+        def broken(method, url, **kwargs):
+            raise error
+        monkeypatch.setattr(transport.session, "request", broken)
+    monkeypatch.setattr(models, "get_transport", lambda: transport)
+    monkeypatch.setattr(models, "get_logo_cache", lambda: None)
+    company = make_company()
+    company.logoUrl = logo_url
+    assert presenters.DeckbotPresenter().fetch_logo(company) is None
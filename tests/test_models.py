@@ -0,0 +1,133 @@
+#----------------------------------------------------------------------------
+# Name:        test_models.py
+# Purpose:     Tests for the Company and Metric Models
+# Author:    Drew Fulton
+# Created:    October 2026
+
+import threading, time, warnings
+
+import numpy as np
+import pytest
+import requests
+
+import models
+
+
+def peer_chart(values):
+    ''' A one-column PeerChart with a row per value, named A, B, ...
+    '''
+    companies = [
+        {"name": chr(ord("A") + i), "data": [{"label": "LTM", "period": "ltm", "value": v}]}
+        for i, v in enumerate(values)
+    ]
+    return models.PeerChart.from_json({"companies": companies})
+
+
+def test_quartile_runs_from_top_to_bottom():
+    chart = peer_chart([10, 20, 30, 40, 50])
+    assert chart.quartile("E", 0) == 1
+    assert chart.quartile("A", 0) == 4
+
+
+def test_quartile_is_none_without_a_value():
+    assert peer_chart([10, None, 30]).quartile("B", 0) is None
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert peer_chart([None, None]).quartile("A", 0) is None
+
+
+def test_growth_treats_unchanged_zero_as_flat():
+    companies = [
+        {"name": name, "data": [{"label": "2018", "value": a}, {"label": "2019", "value": b}]}
+        for name, a, b in (("A", 0, 0), ("B", 10, 15), ("C", None, 5))
+    ]
+    growth = models.PeerChart.from_json({"companies": companies}).growth(0, 1)
+    assert growth[0] == 0
+    assert growth[1] == 0.5
+    assert np.isnan(growth[2])
+
+
+class CutOffResponse(object):
+    ''' A streamed listing whose connection drops after the first company
+    '''
+    status_code = 200
+    links = {}
+
+    def iter_content(self, chunk_size):
+        yield b'[{"_id": "id1", "name": "Apple"},'
+        raise requests.exceptions.ChunkedEncodingError("Connection broken")
+
+    def close(self):
+        pass
+
+
+def test_cut_off_listing_raises_databook_error(monkeypatch):
+    monkeypatch.setattr(models, "get_authorized", lambda url, **kwargs: CutOffResponse())
+    companies = models.iter_companies()
+    assert next(companies)["id"] == "id1"
+    with pytest.raises(models.DatabookConnectionError):
+        next(companies)
+
+
+def test_transport_retries_a_broken_body_then_raises_databook_error(monkeypatch):
+    transport = models.Transport(max_retries=2, backoff_factor=0, rate_limit=0)
+    calls = []
+
+    def broken(method, url, **kwargs):
+        calls.append(url)
+        raise requests.exceptions.ChunkedEncodingError("Connection broken")
+
+    monkeypatch.setattr(transport.session, "request", broken)
+    with pytest.raises(models.DatabookConnectionError):
+        transport.get("https://example.com/logo.png")
+    assert len(calls) == 3
+
+
+def test_transport_wraps_a_malformed_url():
+    with pytest.raises(models.DatabookRequestError):
+        models.Transport(rate_limit=0).get("not-a-url")
+
+
+class LongListingResponse(object):
+    ''' A streamed listing of 1000 companies, one per chunk, counting the
+    chunks read
+    '''
+    status_code = 200
+    links = {}
+
+    def __init__(self):
+        self.read = 0
+        self.closed = threading.Event()
+
+    def iter_content(self, chunk_size):
+        yield b"["
+        for i in range(1000):
+            self.read += 1
+            yield (b"," if i else b"") + f'{{"_id": "id{i}", "name": "Company {i}"}}'.encode()
+        yield b"]"
+
+    def close(self):
+        self.closed.set()
+
+
+def test_listing_is_read_ahead_only_so_far(monkeypatch):
+    response = LongListingResponse()
+    monkeypatch.setattr(models, "get_authorized", lambda url, **kwargs: response)
+    monkeypatch.setattr(models, "listing_read_ahead", 5)
+    companies = models.iter_companies()
+    assert next(companies)["id"] == "id0"
+    time.sleep(0.2)
+    assert response.read <= 8
+    companies.close()
+    assert response.closed.wait(2)
+
+
+def test_url_locks_are_removed_when_released(tmp_path):
+    path = str(tmp_path / "locks" / "url.lock")
+    with models.FileLock(path, remove=True):
+        assert (tmp_path / "locks" / "url.lock").exists()
+    assert not (tmp_path / "locks" / "url.lock").exists()
+
+
+def test_worker_pools_split_the_request_rate():
+    assert models.worker_settings(4)["rate_share"] == models.rate_share / 4
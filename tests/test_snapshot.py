@@ -0,0 +1,157 @@
+#----------------------------------------------------------------------------
+# Name:        test_snapshot.py
+# Purpose:     Tests for Syncing into the Offline Snapshot
+# Author:    Drew Fulton
+# Created:    October 2026
+
+import json
+
+import pytest
+
+import models
+import presenters
+import snapshot
+from conftest import overview_response, revenue_details
+
+
+class FakeResponse(object):
+    def __init__(self, body):
+        self.content = json.dumps(body).encode()
+
+
+@pytest.fixture
+def api(monkeypatch):
+    ''' A fake API whose responses are set per company id.  Like the
+    response cache, it answers a path it has served before with the same
+    response unless asked to revalidate.  Returns (responses, fetched paths).
+    '''
+    responses, fetched, cached = {}, [], {}
+
+    def get_api(path, revalidate=False):
+        if path in cached and not revalidate:
+            return cached[path]
+        fetched.append(path)
+        parts = path[len(models.endpoint):].split("/")
+        company = responses[parts[3]]
+        if len(parts) == 4:
+            cached[path] = FakeResponse(company["overview"])
+        elif len(parts) == 5:
+            cached[path] = FakeResponse([{"_id": "revenue", "name": "Revenue", "description": "Total revenue"}])
+        else:
+            cached[path] = FakeResponse(company["details"])
+        return cached[path]
+
+    monkeypatch.setattr(models, "get_api", get_api)
+    return responses, fetched
+
+
+def add_company(responses, name, peers, quarter=4, scale=1.0):
+    responses[f"id{name}"] = {
+        "overview": overview_response(f"id{name}", name, quarter=quarter),
+        "details": revenue_details(peers, scale),
+    }
+
+
+def chart_names(details):
+    return [company["name"] for company in details["chart"][0]["companies"]]
+
+
+def test_sync_keeps_each_companys_own_peer_group(tmp_path, api):
+    responses, fetched = api
+    add_company(responses, "HP", ("HP", "Apple", "Samsung"))
+    add_company(responses, "Apple", ("Apple", "Dell"))
+    store = snapshot.SnapshotStore(str(tmp_path / "s.sqlite3"))
+    models.sync_company(store, "idHP", ["Revenue"])
+    models.sync_company(store, "idApple", ["Revenue"])
+    assert f"{models.endpoint}/api/companies/idApple/metrics/revenue" in fetched
+    assert chart_names(store.details("Revenue", "idApple")) == ["Apple", "Dell"]
+    assert chart_names(store.details("Revenue", "idHP")) == ["HP", "Apple", "Samsung"]
+
+
+def test_details_are_not_borrowed_from_a_peers_chart(tmp_path, api):
+    responses, fetched = api
+    add_company(responses, "HP", ("HP", "Apple", "Samsung"))
+    store = snapshot.SnapshotStore(str(tmp_path / "s.sqlite3"))
+    models.sync_company(store, "idHP", ["Revenue"])
+    assert store.details("Revenue", "idApple") is None
+
+
+def test_reporting_key_changes_only_when_a_quarter_is_reported():
+    before = overview_response("idApple", "Apple", quarter=4, year=2019)
+    assert snapshot.reporting_key(before) == snapshot.reporting_key(dict(before, employees=0.2))
+    assert snapshot.reporting_key(before) != snapshot.reporting_key(
+        overview_response("idApple", "Apple", quarter=1, year=2020)
+    )
+    assert snapshot.reporting_key(before) != snapshot.reporting_key(dict(before, currentQuarter=2))
+
+
+def test_sync_fetches_in_full_only_after_a_report(tmp_path, api):
+    responses, fetched = api
+    add_company(responses, "Apple", ("Apple", "Dell"))
+    store = snapshot.SnapshotStore(str(tmp_path / "s.sqlite3"))
+    assert models.sync_company(store, "idApple", ["Revenue"]) == ("Apple", True)
+    fetched.clear()
+    assert models.sync_company(store, "idApple", ["Revenue"]) == ("Apple", False)
+    assert fetched == [f"{models.endpoint}/api/companies/idApple"]
+    add_company(responses, "Apple", ("Apple", "Dell"), quarter=1)
+    assert models.sync_company(store, "idApple", ["Revenue"]) == ("Apple", True)
+    assert len(fetched) == 4
+
+
+def test_sync_after_a_report_stores_the_new_figures(tmp_path, api):
+    responses, fetched = api
+    add_company(responses, "Apple", ("Apple", "Dell"))
+    store = snapshot.SnapshotStore(str(tmp_path / "s.sqlite3"))
+    models.sync_company(store, "idApple", ["Revenue"])
+    add_company(responses, "Apple", ("Apple", "Dell"), quarter=1, scale=2.0)
+    models.sync_company(store, "idApple", ["Revenue"])
+    apple = store.details("Revenue", "idApple")["chart"][0]["companies"][0]
+    assert [point["value"] for point in apple["data"]][1:] == [105.0, 100.0, 90.0]
+
+
+def test_enqueue_keeps_the_first_reason_and_order(tmp_path):
+    store = snapshot.SnapshotStore(str(tmp_path / "s.sqlite3"))
+    store.enqueue(["idHP", "idApple"], "reported")
+    store.enqueue(["idDell", "idApple"], "peer reported")
+    assert store.queued() == ["idApple", "idHP", "idDell"]
+    reasons = dict(store.connect().execute("SELECT company_id, reason FROM render_queue"))
+    assert reasons == {"idApple": "reported", "idHP": "reported", "idDell": "peer reported"}
+
+
+def test_mark_rendered_dequeues_until_the_next_report(tmp_path):
+    store = snapshot.SnapshotStore(str(tmp_path / "s.sqlite3"))
+    store.save_overview(overview_response("idApple", "Apple"))
+    store.save_overview(overview_response("idHP", "HP"))
+    assert store.unrendered(["idApple", "idHP", "idDell"]) == ["idApple", "idHP"]
+    store.enqueue(["idApple", "idHP"], "reported")
+    store.mark_rendered("idApple")
+    assert store.queued() == ["idHP"]
+    assert store.unrendered(["idApple", "idHP"]) == ["idHP"]
+    store.save_overview(overview_response("idApple", "Apple", quarter=1, year=2020))
+    assert store.unrendered(["idApple", "idHP"]) == ["idApple", "idHP"]
+
+
+class QuietView(object):
+    def report_result(self, result):
+        pass
+
+    def report_sync(self, results, seconds, path, queued):
+        pass
+
+
+def test_sync_run_queues_reporters_and_decks_that_chart_them(tmp_path, api, monkeypatch):
+    responses, fetched = api
+    add_company(responses, "Apple", ("Apple", "Dell"))
+    add_company(responses, "Dell", ("Dell", "HP"))
+    add_company(responses, "HP", ("HP", "Apple"))
+    store = snapshot.SnapshotStore(str(tmp_path / "s.sqlite3"))
+    monkeypatch.setattr(models, "get_snapshot_store", lambda: store)
+    monkeypatch.setattr(models, "get_token", lambda: pytest.fail("logged in up front"))
+    sync = presenters.SyncPresenter(QuietView(), workers=2)
+    sync.run(["idApple", "idDell", "idHP"])
+    for company_id in store.queued():
+        store.mark_rendered(company_id)
+    add_company(responses, "Apple", ("Apple", "Dell"), quarter=1)
+    results = sync.run(["idApple", "idDell", "idHP"])
+    assert sorted(r.company_id for r in results if not r.unchanged) == ["idApple"]
+    assert store.queued() == ["idApple", "idHP"]
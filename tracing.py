@@ -0,0 +1,175 @@
+#----------------------------------------------------------------------------
+# Name:        tracing.py
+# Purpose:     Timing Spans for the Fetch and Render Pipeline
+# Author:    Drew Fulton
+# Created:    October 2026
+#
+# Tracing is off unless start() is called (deckbot.py --profile).  While off,
+# span() hands back a shared no-op so the instrumented code pays almost
+# nothing.  Spans are appended to a spool file one JSON line per span, which
+# also works from forked batch and service workers; finish() turns the spool
+# into a Chrome trace (chrome://tracing or Perfetto) if that was asked for.
+
+import os, json, time, threading
+
+tracer = None
+
+
+class Tracer(object):
+    ''' Writes finished spans as JSON lines to a file opened for appending.
+    Each span is a single write, so spans from several processes sharing the
+    file do not interleave.
+    '''
+    def __init__(self, path, chrome_path=None, truncate=True):
+        self.path = path
+        self.chrome_path = chrome_path
+        self.owner_pid = os.getpid()
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND | (os.O_TRUNC if truncate else 0)
+        self.fd = os.open(path, flags, 0o644)
+        self.local = threading.local()
+
+    def stack(self):
+        if not hasattr(self.local, "spans"):
+            self.local.spans = []
+        return self.local.spans
+
+    def emit(self, record):
+        os.write(self.fd, (json.dumps(record) + "\n").encode("utf-8"))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Span(object):
+    ''' A timed section of work.  Attributes can be added while it is open
+    with annotate().
+    '''
+    __slots__ = ("name", "category", "attrs", "start", "t0")
+
+    def __init__(self, name, category, attrs):
+        self.name = name
+        self.category = category
+        self.attrs = attrs
+
+    def __enter__(self):
+        tracer.stack().append(self)
+        self.start = time.time()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.t0
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        stack = tracer.stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        tracer.emit({
+            "name": self.name,
+            "cat": self.category,
+            "start": self.start,
+            "duration": duration,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "attrs": self.attrs,
+        })
+        return False
+
+
+class NullSpan(object):
+    ''' Stands in for Span while tracing is off
+    '''
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+null_span = NullSpan()
+
+
+def span(name, category="deckbot", **attrs):
+    ''' Context manager timing the enclosed work as one span
+    '''
+    if tracer is None:
+        return null_span
+    return Span(name, category, attrs)
+
+
+def annotate(**attrs):
+    ''' Add attributes to the innermost open span on this thread, if any
+    '''
+    if tracer is None:
+        return
+    stack = tracer.stack()
+    if stack:
+        stack[-1].attrs.update(attrs)
+
+
+def start(path, chrome=None):
+    ''' Start tracing to path.  Writes JSON lines, or a Chrome trace if chrome
+    is true (the default for paths ending in .json).
+    '''
+    global tracer
+    if chrome is None:
+        chrome = path.endswith(".json")
+    if chrome:
+        tracer = Tracer(f"{path}.spool", chrome_path=path)
+    else:
+        tracer = Tracer(path)
+    return tracer
+
+
+def spool_path():
+    ''' The file spans are being written to, or None while tracing is off
+    '''
+    return tracer.path if tracer is not None else None
+
+
+def join(path):
+    ''' Append spans to the spool of a trace started by another process, as
+    a spawned worker does.  A forked worker already shares its parent's.
+    '''
+    global tracer
+    if tracer is None and path is not None:
+        tracer = Tracer(path, truncate=False)
+        tracer.owner_pid = None
+    return tracer
+
+
+def finish():
+    ''' Stop tracing and, for a Chrome trace, convert the spooled spans.  Only
+    the process that started tracing does this.
+    '''
+    global tracer
+    if tracer is None or tracer.owner_pid != os.getpid():
+        return
+    tracer.close()
+    if tracer.chrome_path is not None:
+        write_chrome_trace(tracer.path, tracer.chrome_path)
+        os.remove(tracer.path)
+    tracer = None
+
+
+def write_chrome_trace(spool_path, chrome_path):
+    ''' Convert spooled JSON lines into the Chrome trace event format
+    '''
+    events = []
+    with open(spool_path) as f:
+        for line in f:
+            record = json.loads(line)
+            events.append({
+                "name": record["name"],
+                "cat": record["cat"],
+                "ph": "X",
+                "ts": record["start"] * 1e6,
+                "dur": record["duration"] * 1e6,
+                "pid": record["pid"],
+                "tid": record["tid"],
+                "args": record["attrs"],
+            })
+    with open(chrome_path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
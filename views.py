@@ -13,23 +13,87 @@ class DeckbotCLI(object):
         '''
         self.company_list = company_list
         
-    def select_company(self, company_list):
-        self.company_list = company_list
-        i=1
-        print("Enter a Number to select a Company")
-        for comp in self.company_list:
-            print(f"[{i}] - {comp.name}")
-            i = i+1
+    def select_company(self, company_index, page_size=10):
+        ''' Search a CompanyIndex by name, alias or id and return the chosen
+        entry.  Results are shown a page at a time.
+        '''
+        results = company_index.search("")
+        page = 0
+        print("Type part of a company name to search, n/p for the next or previous page,")
+        print("or a number to select a Company")
         while True:
-            try:
-                sel = input("Enter Selection: ")
-                sel = int(sel)
-                selected_company = company_list[int(sel)-1]
-                break
-            except ValueError: 
-                print("Your selection is not a valid integer.  Please try again.")
-            except IndexError:
+            first = page * page_size
+            if not results:
+                print("No companies match.  Please try another search.")
+            for i, comp in enumerate(results[first:first + page_size], first + 1):
+                print(f"[{i}] - {comp['name']}")
+            if len(results) > page_size:
+                pages = (len(results) + page_size - 1) // page_size
+                print(f"Page {page + 1} of {pages} ({len(results)} companies)")
+            sel = input("Search or select: ").strip()
+            if sel.isdigit():
+                if 1 <= int(sel) <= len(results):
+                    return results[int(sel) - 1]
                 print("Your selection is not in the correct range.  Please try again.")
-        
-        return selected_company
+            elif sel.lower() == "n" and first + page_size < len(results):
+                page += 1
+            elif sel.lower() == "p" and page > 0:
+                page -= 1
+            elif sel.lower() not in ("n", "p"):
+                results = company_index.search(sel)
+                page = 0
+
+    def report_result(self, result):
+        ''' Print the outcome of one deck in batch mode
+        '''
+        name = result.name or result.company_id
+        if result.ok and result.unchanged:
+            print(f"[same]   {name} ({result.seconds:.1f}s) - {result.path}")
+        elif result.ok:
+            print(f"[ok]     {name} ({result.seconds:.1f}s) - {result.path}")
+        else:
+            print(f"[failed] {name} ({result.seconds:.1f}s) - {result.error}")
+
+    def report_summary(self, results, seconds):
+        ''' Print totals and throughput once a batch has finished
+        '''
+        succeeded = sum(1 for r in results if r.ok)
+        unchanged = sum(1 for r in results if r.ok and r.unchanged)
+        failed = len(results) - succeeded
+        rate = succeeded / seconds if seconds else 0
+        print(f"{succeeded - unchanged} decks created, {unchanged} unchanged, {failed} failed in {seconds:.1f}s ({rate:.2f} decks/second)")
+        cache_totals = {}
+        for r in results:
+            for counter, value in r.cache_stats.items():
+                cache_totals[counter] = cache_totals.get(counter, 0) + value
+        self.report_cache(cache_totals)
+
+    def report_combined(self, results, seconds, path, slides, cache_stats):
+        ''' Print totals once a combined deck has been written
+        '''
+        succeeded = sum(1 for r in results if r.ok)
+        failed = len(results) - succeeded
+        print(f"{slides} slides for {succeeded} companies, {failed} failed, in {seconds:.1f}s")
+        if path is not None:
+            print(f"Please find your combined deck at {path}")
+        self.report_cache(cache_stats)
 
+    def report_sync(self, results, seconds, path, queued):
+        ''' Print totals once companies have been synced into the snapshot
+        '''
+        succeeded = sum(1 for r in results if r.ok)
+        reported = sum(1 for r in results if r.ok and not r.unchanged)
+        failed = len(results) - succeeded
+        print(f"{succeeded} companies synced ({reported} new or reported), {failed} failed in {seconds:.1f}s into {path}")
+        print(f"{queued} decks queued for prerender")
+
+    def report_cache(self, cache_totals):
+        ''' Print response cache and peer data counters, for whichever were on
+        '''
+        if "hits" in cache_totals:
+            print(f"Response cache: {cache_totals['hits']} hits, {cache_totals['misses']} misses, {cache_totals['revalidated']} revalidated")
+        if "peer_hits" in cache_totals:
+            print(
+                f"Peer data: {cache_totals['peer_hits']} metric details reused from peers, "
+                f"{cache_totals['peer_own']} kept from earlier runs, {cache_totals['peer_misses']} fetched"
+            )